@@ -0,0 +1,51 @@
+"""Import each lazily loaded mpgdb submodule on its own, in a fresh gdb.
+
+Usage: python check_imports.py ELF [GDB]
+
+mpgdb imports most submodules on first use, so the order they are imported
+in depends on which command runs first. Each submodule must therefore import
+cleanly without any other submodule having been imported before it.
+"""
+import os, subprocess, sys
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+def lazy_submodules() -> list[str]:
+    # Parse _SUBMODULES rather than importing mpgdb, which needs gdb.
+    with open(os.path.join(REPO, "mpgdb", "__init__.py")) as f:
+        source = f.read()
+    start = source.index("_SUBMODULES = {")
+    end = source.index("}", start)
+    return sorted(name.strip().strip('"') for name in source[start + len("_SUBMODULES = {"):end].split(","))
+
+def check(elf:str, name:str, gdb:str="gdb") -> str|None:
+    """None if `mpgdb.<name>` imports in a fresh gdb, otherwise its output."""
+    result = subprocess.run([
+        gdb, "-batch", "-nx",
+        "-ex", f"python import sys; sys.path.insert(0, {REPO!r})",
+        "-ex", f"file {elf}",
+        "-ex", f"python import mpgdb.{name}",
+    ], capture_output=True, text=True)
+    output = result.stdout + result.stderr
+    if result.returncode != 0 or "Traceback" in output or "Error while executing Python code" in output:
+        return output
+    return None
+
+def main(argv:list[str]) -> int:
+    if len(argv) not in (2, 3):
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    elf = argv[1]
+    gdb = argv[2] if len(argv) == 3 else "gdb"
+    failed = 0
+    for name in lazy_submodules():
+        output = check(elf, name, gdb)
+        if output is None:
+            print(f"ok      mpgdb.{name}")
+        else:
+            failed += 1
+            print(f"FAILED  mpgdb.{name}\n{output}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
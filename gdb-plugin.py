@@ -1,5 +1,5 @@
 from __future__ import annotations
-import logging, sys, os, importlib, enum, functools, re
+import logging, sys, time, enum, functools, re, itertools, json, csv
 logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)])
 log = logging.getLogger("gdb.micropython")
 
@@ -8,35 +8,10 @@ if TYPE_CHECKING:
     sys.path.append('/usr/local/share/gdb/python')
     import gdb
 
-try:
-    if TYPE_CHECKING:
-        import mpy_tool
-    else:
-        if "mpy-tool" not in sys.modules:
-            mpy_tools_folder = os.path.normpath(os.path.join(gdb.current_objfile().filename, "..", "..", "..", "..", "tools"))
-            log.info("Importing mpy-tool from %s.", mpy_tools_folder)
-
-            sys.modules["makeqstrdata"]={}
-            sys.path.append(mpy_tools_folder)
-            mpy_tool = importlib.import_module("mpy-tool")
-        mpy_tool = sys.modules["mpy-tool"]
-    log.info("Imported mpy-tool.")
-    has_mpy_tool = True
-except ImportError:
-    log.warning("Cannot import mpy-tool. Disassembly will be unavailable.")
-    has_mpy_tool = False
-
-try:
-    import pydot
-    has_pydot = True
-except ImportError:
-    log.warning("Cannot import pydot. Heap graph output will be unavailable.")
-    has_pydot = False
-
-
+_plugin_start = time.perf_counter()
 try:
     import mpgdb
-    from mpgdb import mp
+    from mpgdb import mp, heap, dot, mem, depver, startup
 except Exception as e:
     log.exception("%r", e, exc_info=True, stack_info=True)
     raise e
@@ -112,160 +87,246 @@ class MpyObj(gdb.Command):
         return gdb.COMPLETE_NONE
 
     def invoke(self, args, from_tty):
-        print(get_pyobj_str(gdb.parse_and_eval(args)))
+        value = gdb.parse_and_eval(args)
+        heap.prefetch(value)
+        print(get_pyobj_str(value))
 MpyObj()
 
 
 
 
 def get_pydis(bc):
-    sig = MPY_BC_Sig()
-    sig.load(bc, 0)
+    sig = mpgdb.bytecode.functions.get(bc)
     sig.print()
     mpy_disassemble(bc, sig.end, None)
 
 class MpyDis(gdb.Command):
     """Dissasemble MicroPython bytecode.
     Usage: mpy dis VALUE
+           mpy dis --all [-j JOBS] [FILE]
+    With --all, find every bytecode function on the heap and frozen in ROM,
+    and write an index of their address ranges and source lines followed by
+    their disassembly to FILE, or to the console. Decoding runs in JOBS
+    processes (default: one per CPU).
     """
     def __init__(self):
         super(MpyDis, self).__init__("mpy dis", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
         log.info("Registered command: mpy dis")
 
     def invoke(self, args, from_tty):
+        if depver.mpytool() is None:
+            raise gdb.GdbError("Cannot import mpy-tool, disassembly is unavailable.")
+        argv = gdb.string_to_argv(args)
+        if argv[:1] == ["--all"]:
+            return self.invoke_all(argv[1:])
         value = gdb.parse_and_eval(args)
         objtype = value.cast(mp.obj.base_t)["type"]
         if int(objtype) == int(mp.type.fun_bc):
             get_pydis(value.cast(mp.obj.fun_bc_t))
 
-if has_mpy_tool:
-    MpyDis()
+    def invoke_all(self, argv):
+        usage = "Usage: mpy dis --all [-j JOBS] [FILE]"
+        workers = None
+        if argv[:1] == ["-j"]:
+            try:
+                workers = int(argv[1])
+            except (IndexError, ValueError):
+                raise gdb.GdbError(usage)
+            argv = argv[2:]
+        if len(argv) > 1:
+            raise gdb.GdbError(usage)
+        if argv:
+            with open(argv[0], "w") as out:
+                count = write_bytecode_listing(out, workers)
+            print(f"Wrote {count} functions to {argv[0]}")
+        else:
+            write_bytecode_listing(sys.stdout, workers)
 
+MpyDis()
 
-def mpy_disassemble(fun_bc, ptr, current_ptr):
+
+def disassembly_lines(info, instructions, ptr, show_lines=False):
+    mpy_tool = depver.mpytool()
     Opcode = mpy_tool.Opcode
 
-    bc = fun_bc["bytecode"]
-    qstr_table = fun_bc["context"]["constants"]["qstr_table"]
-    obj_table = fun_bc["context"]["constants"]["obj_table"]
-    biggest_jump = 0
-    instructions = []
-    offsets = []
-    labels = dict()
-    ip = ptr
-    while True:
-        offsets.append(ptr)
-        op = int(bc[ip])
-        fmt, sz, arg, _ = mpy_tool.mp_opcode_decode(bc, ip)
-        if (bc[ip] & 0xf0) == Opcode.MP_BC_BASE_JUMP_E:
-            biggest_jump = max(biggest_jump, ip + arg)
-        if bc[ip] == Opcode.MP_BC_LOAD_CONST_OBJ:
-            arg = get_pyobj_str(obj_table[arg])
-            pass
-        if fmt == mpy_tool.MP_BC_FORMAT_QSTR:
-            arg = mp.qstr.get(qstr_table[arg]).string()
+    # Read each constant table once, as far as this function uses it.
+    qstr_count = max((arg + 1 for _, _, fmt, _, arg in instructions if fmt == mpy_tool.MP_BC_FORMAT_QSTR), default=0)
+    obj_count = max((arg + 1 for _, op, _, _, arg in instructions if op == Opcode.MP_BC_LOAD_CONST_OBJ), default=0)
+    qstrs = info.qstrs(qstr_count)
+    objs = info.objs(obj_count)
+    for ip, op, fmt, sz, arg in instructions:
+        if op == Opcode.MP_BC_LOAD_CONST_OBJ:
+            arg = get_pyobj_str(objs[arg])
+        elif fmt == mpy_tool.MP_BC_FORMAT_QSTR:
+            arg = qstrs[arg]
         elif fmt in (mpy_tool.MP_BC_FORMAT_VAR_UINT, mpy_tool.MP_BC_FORMAT_OFFSET):
             pass
         else:
             arg = ""
-        print(
-            "  %04x %s %s" % (ip - ptr, Opcode.mapping[bc[ip]], arg)
-        )
-        if bc[ip] == Opcode.MP_BC_RETURN_VALUE:
-            if biggest_jump < ip:
-                break
-        ip += sz
-        #self.disassemble_children()
-
-# bytecode layout:
-#
-#  func signature  : var uint
-#      contains six values interleaved bit-wise as: xSSSSEAA [xFSSKAED repeated]
-#          x = extension           another byte follows
-#          S = n_state - 1         number of entries in Python value stack
-#          E = n_exc_stack         number of entries in exception stack
-#          F = scope_flags         four bits of flags, MP_SCOPE_FLAG_xxx
-#          A = n_pos_args          number of arguments this function takes
-#          K = n_kwonly_args       number of keyword-only arguments this function takes
-#          D = n_def_pos_args      number of default positional arguments
-#
-#  prelude size    : var uint
-#      contains two values interleaved bit-wise as: xIIIIIIC repeated
-#          x = extension           another byte follows
-#          I = n_info              number of bytes in source info section (always > 0)
-#          C = n_cells             number of bytes/cells in closure section
-#
-#  source info section:
-#      simple_name : var qstr      always exists
-#      argname0    : var qstr
-#      ...         : var qstr
-#      argnameN    : var qstr      N = num_pos_args + num_kwonly_args - 1
-#      <line number info>
-#
-#  closure section:
-#      local_num0  : byte
-#      ...         : byte
-#      local_numN  : byte          N = n_cells-1
-#
-#  <bytecode>                   // bytecode layout:
-class MPY_BC_Sig:
+        if show_lines:
+            yield "  %04x %5d %s %s" % (ip - ptr, info.map_line(ip - ptr), Opcode.mapping[op], arg)
+        else:
+            yield "  %04x %s %s" % (ip - ptr, Opcode.mapping[op], arg)
+
+def mpy_disassemble(fun_bc, ptr, current_ptr):
+    info = mpgdb.bytecode.functions.get(fun_bc)
+    instructions = mpgdb.bytecode.decode(info.code, ptr, depver.mpytool())
+    for line in disassembly_lines(info, instructions, ptr):
+        print(line)
+
+def write_bytecode_listing(out, workers=None) -> int:
+    """Index and disassemble every bytecode function; returns how many were written."""
+    snapshot = heap.current()
+    fun_bc_struct = mp.obj.fun_bc_t.target()
+    functions = []
+    for addr in mpgdb.bytecode.find_functions(snapshot):
+        fun_bc = mem.value(addr, fun_bc_struct)
+        try:
+            info = mpgdb.bytecode.functions.get(fun_bc, snapshot)
+        except (gdb.error, IndexError) as e:
+            log.warning("Skipping fun_bc at %#x: %s", addr, e)
+            continue
+        functions.append((addr, info))
+    decoded = mpgdb.bytecode.decode_all(mpgdb.bytecode.decode_jobs([info for _, info in functions]), workers)
+
+    entries = []
+    for (addr, info), instructions in zip(functions, decoded):
+        code_end = instructions[-1][0] + instructions[-1][3] if instructions else info.end
+        where = "heap" if snapshot.get_ptr_area(info.bytecode, aligned=False) else "rom"
+        entries.append((info.source or "?", info.map_line(0), addr, info, instructions, code_end, where))
+    entries.sort(key=lambda entry: entry[:3])
+
+    out.write(f"# {len(entries)} bytecode functions\n")
+    for source, first_line, addr, info, instructions, code_end, where in entries:
+        out.write(f"{info.bytecode:#010x}-{info.bytecode + code_end:#010x} {where:4} {source}:{first_line} {info.function_name}\n")
+    for source, first_line, addr, info, instructions, code_end, where in entries:
+        out.write(f"\n{source}:{first_line} {info.function_name}({', '.join(map(str, info.args))})"
+                  f" fun_bc {addr:#x} bytecode {info.bytecode:#x}-{info.bytecode + code_end:#x} [{where}]\n")
+        for line, ranges in sorted(info.line_ranges.items()):
+            spans = ", ".join(
+                f"{info.bytecode + info.end + start:#x}-{info.bytecode + (info.end + end if end is not None else code_end):#x}"
+                for start, end in ranges
+            )
+            out.write(f"  line {line}: {spans}\n")
+        for text in disassembly_lines(info, instructions, info.end, show_lines=True):
+            out.write(text + "\n")
+    return len(entries)
+
+DEFAULT_BREAK_LOCATION = "mp_execute_bytecode:dispatch_loop"
+
+class BreakLocationParameter(gdb.Parameter):
+    """Configure where `mpy break` stops to compare the bytecode instruction pointer.
+    The location must be reached once per opcode, with `ip` or `code_state` in scope.
+    With MICROPY_OPT_COMPUTED_GOTO, `dispatch_loop` is only reached on some opcodes,
+    so `mpy break` refuses the default location in such builds.
+    """
+    def __init__(self, name:str):
+        self.set_doc = "Configure where mpy break stops to check the instruction pointer."
+        super().__init__(name, gdb.COMMAND_BREAKPOINTS, gdb.PARAM_STRING)
+        self.value = DEFAULT_BREAK_LOCATION
+        log.info("Registered parameter: %s", name)
+
+break_location = BreakLocationParameter("mpy break-location")
+
+def uses_computed_goto() -> bool:
+    """Whether the VM dispatches each opcode through its own `goto *entry_table[...]`."""
+    value = mp.macro._get("MICROPY_OPT_COMPUTED_GOTO")
+    return value is not None and int(value) != 0
+
+def check_break_location(location:str):
+    """Refuse `dispatch_loop` when computed gotos bypass it, rather than silently missing lines."""
+    if location.rpartition(":")[2] == "dispatch_loop" and uses_computed_goto():
+        raise gdb.GdbError(
+            "This build uses MICROPY_OPT_COMPUTED_GOTO: opcodes jump straight to the next handler, "
+            "so `dispatch_loop` is not reached for every instruction and Python breakpoints would be missed. "
+            "Rebuild with MICROPY_OPT_COMPUTED_GOTO=0, or `set mpy break-location` to a location "
+            "reached once per opcode.")
+_line_breakpoint = None
+
+class MpyBreak(gdb.Command):
+    """Break on a line of Python source.
+    Usage: mpy break FILE:LINE
+           mpy break -d [FILE:LINE]   (delete one, or all)
+           mpy break -r               (re-resolve after new functions are created)
+           mpy break                  (list)
+    The line is looked up in the line table of every known bytecode function.
+    A single breakpoint at `mpy break-location` then stops only when the
+    instruction pointer is at one of those addresses.
+    """
     def __init__(self):
-        pass
+        super(MpyBreak, self).__init__("mpy break", gdb.COMMAND_BREAKPOINTS, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy break")
+
+    @staticmethod
+    def parse(spec):
+        source, sep, line = spec.rpartition(":")
+        if not sep or not source or not line.isdigit():
+            raise gdb.GdbError(f"Expected FILE:LINE, not {spec!r}")
+        return source, int(line)
+
+    @staticmethod
+    def known_functions():
+        # Addresses go on the live target, so never resolve them from a loaded file.
+        if heap.loaded is not None:
+            raise gdb.GdbError("A heap snapshot is loaded from a file; use `mpy heap load` without a file "
+                               "to go back to the target before setting Python breakpoints.")
+        snapshot = heap.HeapSnapshot.capture()
+        fun_bc_struct = mp.obj.fun_bc_t.target()
+        functions = []
+        for addr in mpgdb.bytecode.find_functions(snapshot):
+            try:
+                functions.append(mpgdb.bytecode.functions.get(mem.value(addr, fun_bc_struct), snapshot))
+            except (gdb.error, IndexError) as e:
+                log.debug("Skipping fun_bc at %#x: %s", addr, e)
+        return functions
 
-    def load(self, fun_bc, ip):
-        bytecode = fun_bc["bytecode"]
-        qstr_table = fun_bc["context"]["constants"]["qstr_table"]
-        sig = mpy_tool.extract_prelude(bytecode, ip)
-        (self.S, self.E, self.F, self.A, self.K, self.D) = sig[5]
-        (self.I, self.C) = sig[6]
-        self.end = sig[4]
-        self.lines = []
-        print(qstr_table[0])
-        self.function_name = MpyQstr.mp.qstr.get(qstr_table[sig[7][0]]).string()
-        self.args = [mp.qstr.get(qstr_table[int(i)]).string() for i in sig[7][1:]]
-        self.source = get_qstr(qstr_table[0])
-            
-        #now 1 qstr function name
-        #now A + K strings, args
-        source_line = 1
-        ptr = sig[2]
-        while ptr < sig[3]:
-            c = int(bytecode[ptr])
-            b = 0
-            l = 0
-            if (c & 0x80) == 0:
-                # 0b0LLBBBBB encoding
-                b = c & 0x1f
-                l = c >> 5
-                ptr += 1
+    def invoke(self, args, from_tty):
+        global _line_breakpoint
+        argv = gdb.string_to_argv(args)
+        bp = _line_breakpoint if _line_breakpoint is not None and _line_breakpoint.is_valid() else None
+
+        if not argv:
+            if bp is None or not bp.lines:
+                print("No Python breakpoints.")
+                return
+            for (source, line), addresses in bp.lines.items():
+                print(f"{source}:{line}: {len(addresses)} locations")
+            return
+
+        if argv[0] == "-d":
+            if bp is None:
+                return
+            if len(argv) > 1:
+                bp.remove_line(*self.parse(argv[1]))
+            if len(argv) == 1 or not bp.lines:
+                bp.delete()
+                _line_breakpoint = None
+            return
+
+        if depver.mpytool() is None:
+            raise gdb.GdbError("Cannot import mpy-tool, Python line tables are unavailable.")
+        if argv[0] == "-r":
+            if bp is None:
+                return
+            specs = list(bp.lines)
+        elif len(argv) == 1:
+            specs = [self.parse(argv[0])]
+        else:
+            raise gdb.GdbError("Usage: mpy break FILE:LINE")
+
+        functions = self.known_functions()
+        if bp is None:
+            check_break_location(break_location.value)
+            bp = _line_breakpoint = mpgdb.bytecode.LineBreakpoint(break_location.value)
+        for source, line in specs:
+            addresses = mpgdb.bytecode.line_addresses(functions, source, line)
+            bp.set_line(source, line, addresses)
+            if addresses:
+                print(f"Python breakpoint at {source}:{line}: {len(addresses)} locations")
             else:
-                # 0b1LLLBBBB 0bLLLLLLLL encoding (l's LSB in second byte)
-                b = c & 0xf
-                l = ((c << 4) & 0x700) | int(bytecode[ptr + 1])
-                ptr += 2
-            self.lines.append((l,b))
-
-    def set_val(self, S, E, F, A, K, D, C, I):
-        self.S = S
-        self.E = E
-        self.F = F
-        self.A = A
-        self.K = K
-        self.D = D
-        self.C = C
-        self.I = I
-
-    def map_line(self, ip):
-        line = 1
-        for (l, b) in self.lines:
-            if b > ip:
-                break
-            line += l
-            ip -= b
-        return line
-
-    def print(self):
-        print("state: " + str(self.S) + ", exc: " + str(self.E) + ", scope: " + str(self.F) + ", pos_args: " + str(self.A) + ", kwonly_args: " + str(self.K) + ", def_args: " + str(self.D) + ", info: " + str(self.I) + ", cells: " + str(self.C))
+                print(f"No code for {source}:{line} in {len(functions)} functions yet; use `mpy break -r` once it is loaded.")
+
+MpyBreak()
 
 
 class InlinedFrameDecorator(gdb.FrameDecorator.FrameDecorator):
@@ -274,8 +335,7 @@ class InlinedFrameDecorator(gdb.FrameDecorator.FrameDecorator):
         super(InlinedFrameDecorator, self).__init__(fobj)
         self.elided_frames = []
         frame = self.inferior_frame()
-        self.sig = MPY_BC_Sig()
-        self.sig.load(frame.read_var("code_state")["fun_bc"], 0)
+        self.sig = mpgdb.bytecode.functions.get(frame.read_var("code_state")["fun_bc"])
 
     def function(self):
         frame = self.inferior_frame()
@@ -299,8 +359,7 @@ class InlinedFrameDecorator(gdb.FrameDecorator.FrameDecorator):
 
     def line(self):
         frame = self.inferior_frame()
-        ip = int(frame.read_var("code_state")["ip"]) - int(frame.read_var("code_state")["fun_bc"]["bytecode"][0].address)
-        return self.sig.map_line(ip)
+        return self.sig.line_at(int(frame.read_var("code_state")["ip"]))
 
 def decorate(frames):
     try:
@@ -336,10 +395,11 @@ class FrameFilter():
         log.info("Registered frame filter: %s", self.name)
 
     def filter(self, frame_iter):
+        if depver.mpytool() is None:
+            return frame_iter
         return iter(decorate(frame_iter))
     
-if has_mpy_tool:
-    FrameFilter()
+FrameFilter()
 
 
 # class MpyMem(gdb.Command):
@@ -349,6 +409,56 @@ if has_mpy_tool:
 #         log.info("Registered group: mpy mem")
 # MpyMem()
 
+class MpyCache(gdb.Command):
+    """Show statistics of the target memory cache.
+    Usage: mpy cache
+    """
+    def __init__(self):
+        super(MpyCache, self).__init__("mpy cache", gdb.COMMAND_DATA, gdb.COMPLETE_NONE, True)
+        log.info("Registered command: mpy cache")
+
+    def invoke(self, args, from_tty):
+        gdb.execute("mpy cache stats", from_tty)
+
+class MpyCacheStats(gdb.Command):
+    """Show hits, misses and target reads of the target memory cache.
+    Usage: mpy cache stats [-r]
+    With -r, reset the counters afterwards.
+    """
+    def __init__(self):
+        super(MpyCacheStats, self).__init__("mpy cache stats", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy cache stats")
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if argv not in ([], ["-r"]):
+            raise gdb.GdbError("Usage: mpy cache stats [-r]")
+        cache = mem.cache
+        lookups = cache.hits + cache.misses
+        ratio = cache.hits / lookups if lookups else 0.0
+        print(f"lines: {len(cache)}/{cache.max_lines} of {cache.line_size} bytes")
+        print(f"hits: {cache.hits}, misses: {cache.misses}, hit ratio: {ratio:.1%}")
+        print(f"target reads: {cache.reads} ({cache.bytes_read} bytes), saved: {max(lookups - cache.reads, 0)}")
+        print(f"prefetched lines: {cache.prefetched}")
+        print(f"flushes: {cache.flushes}")
+        if argv:
+            cache.reset_stats()
+
+class MpyCacheFlush(gdb.Command):
+    """Drop everything in the target memory cache.
+    Usage: mpy cache flush
+    """
+    def __init__(self):
+        super(MpyCacheFlush, self).__init__("mpy cache flush", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy cache flush")
+
+    def invoke(self, args, from_tty):
+        mem.cache.flush()
+
+MpyCache()
+MpyCacheStats()
+MpyCacheFlush()
+
 class MpyGcDumpInfo(gdb.Command):
     """Dump the garbage collector's statistics.
     Usage: mpy mem dump_info
@@ -362,115 +472,87 @@ class MpyGcDumpInfo(gdb.Command):
         # return gdb.execute("call gc_dump_info(&mp_sys_stdout_print)", False, True)
 MpyGcDumpInfo()
     
+# Head block letters used by gc_dump_alloc_table; other heads print as 'h'.
+ALLOC_TABLE_TYPE_LETTERS = {
+    "tuple": "T",
+    "list": "L",
+    "dict": "D",
+    "str": "S",
+    "bytes": "S",
+    "bytearray": "A",
+    "array": "A",
+    "float": "F",
+    "fun_bc": "B",
+    "module": "M",
+}
+
+def get_alloc_table_type_letters() -> dict[int,str]:
+    letters = {}
+    for type_name, letter in ALLOC_TABLE_TYPE_LETTERS.items():
+        mptype = mp.type._get(type_name)
+        if mptype is not None:
+            letters[int(mptype)] = letter
+    return letters
+
 class MpyGcDumpAllocTable(gdb.Command):
-    """Dump the garbage collector's allocation table.
-    Usage: mpy mem dump_alloc_table
+    """Dump the garbage collector's allocation table, without calling into the target.
+    Usage: mpy gc_dump_alloc_table [-a AREA] [-n LINES] [START [END]]
+    Prints the same map as gc_dump_alloc_table: '.' free, '=' tail, 'm' marked,
+    and a type letter (T L D S A F B M, or h) for each head block.
+    START and END are addresses limiting the blocks shown, -a selects one heap
+    area, and -n stops after LINES lines.
     """
     def __init__(self):
-        super(MpyGcDumpAllocTable, self).__init__("mpy gc_dump_alloc_table", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        super(MpyGcDumpAllocTable, self).__init__("mpy gc_dump_alloc_table", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
         log.info("Registered command: mpy gc_dump_alloc_table")
 
     def invoke(self, args, from_tty):
-        print(gdb.execute("call gc_dump_alloc_table(&mp_plat_print)", False, True))
-        # return gdb.execute("call gc_dump_alloc_table(&mp_sys_stdout_print)", False, True)
+        argv = gdb.string_to_argv(args)
+        area_num = None
+        max_lines = None
+        bounds = []
+        try:
+            while argv:
+                arg = argv.pop(0)
+                if arg == "-a":
+                    area_num = int(argv.pop(0), 0)
+                elif arg == "-n":
+                    max_lines = int(argv.pop(0), 0)
+                else:
+                    bounds.append(int(gdb.parse_and_eval(arg)))
+        except (IndexError, ValueError):
+            raise gdb.GdbError("Usage: mpy gc_dump_alloc_table [-a AREA] [-n LINES] [START [END]]")
+        if len(bounds) > 2:
+            raise gdb.GdbError("Usage: mpy gc_dump_alloc_table [-a AREA] [-n LINES] [START [END]]")
+        start_ptr = bounds[0] if bounds else None
+        end_ptr = bounds[1] if len(bounds) > 1 else None
+
+        snapshot = heap.current()
+        letters = get_alloc_table_type_letters()
+
+        def lines():
+            for area in snapshot.areas:
+                if area_num is not None and area.num != area_num:
+                    continue
+                if start_ptr is not None and start_ptr >= area.pool_end:
+                    continue
+                if end_ptr is not None and end_ptr <= area.pool_start:
+                    continue
+                start = area.block_from_ptr(start_ptr) if start_ptr is not None else 0
+                end = -(-(end_ptr - area.pool_start) // BYTES_PER_BLOCK) if end_ptr is not None else None
+
+                yield f"GC memory layout; from {area.pool_start:#x}:"
+                yield from heap.alloc_table_lines(area, letters, start, end)
+
+        print("\n".join(itertools.islice(lines(), max_lines)))
 MpyGcDumpAllocTable()
 
 
-def all_heap_areas(mem_state):
-    heap_area = mem_state["area"]
-    while heap_area:
-        yield heap_area
-        try:
-            heap_area = heap_area["next"]
-        except gdb.error:
-            return
-        
-class BlockTable:
-    def __init_subclass__(cls, blocks_per_byte:int=4, table_name:str="gc_alloc_table_start"):
-        cls.blocks_per_byte = blocks_per_byte
-        cls.bits_per_block = 8 // cls.blocks_per_byte
-        cls.block_mask = ~(-1 << cls.bits_per_block)
-        cls.table_name = table_name
-    @classmethod
-    def lookup(cls, area, block:int):
-        index, shift = divmod(block, cls.blocks_per_byte)
-        shift *= cls.bits_per_block
-        mask = cls.block_mask
-        return int(area[cls.table_name][index]) >> shift & mask
-
-class ATB(BlockTable, enum.IntEnum, blocks_per_byte=4, table_name="gc_alloc_table_start"):
-    FREE = 0
-    HEAD = 1
-    TAIL = 2
-    MARK = 3
-
-class FTB(BlockTable, enum.IntEnum, blocks_per_byte=8, table_name="gc_finaliser_table_start"):
-    CLEAR = 0
-    SET = 1
-
-
-# ATB_BLOCKS_PER_BYTE = 4
-# ATB_BITS_PER_BLOCK = 8 // ATB_BLOCKS_PER_BYTE
-# ATB_BLOCK_MASK = (1<<ATB_BITS_PER_BLOCK) - 1
-# def atb_coordinates(block:int) -> tuple[int,int,int]:
-#     index, shift = divmod(block, ATB_BLOCKS_PER_BYTE)
-#     shift *= ATB_BITS_PER_BLOCK
-#     return index, shift, ATB_BLOCK_MASK
-# def atb_get(area, block:int) -> ATB:
-#     index, shift, mask = atb_coordinates(block)
-#     numeric_kind = int(area["gc_alloc_table_start"][index]) >> shift & mask
-#     return ATB(numeric_kind)
-
-# FTB_BLOCKS_PER_BYTE = 8
-# FTB_BITS_PER_BLOCK = 8 // FTB_BLOCKS_PER_BYTE
-# FTB_BLOCK_MASK = (1<<FTB_BITS_PER_BLOCK) - 1
-# def ftb_coordinates(block:int) -> tuple[int,int,int]:
-#     index, shift = divmod(block, ATB_BLOCKS_PER_BYTE)
-#     shift *= ATB_BITS_PER_BLOCK
-#     return index, shift, ATB_BLOCK_MASK
-# def ftb_get_has_finaliser(area, block:int):
-#     (area["gc_finaliser_table_start"][(block) // BLOCKS_PER_FTB] >> ((block) & 7)) & 1
-
-BYTES_PER_WORD = 4
-BYTES_PER_BLOCK = 4 * BYTES_PER_WORD
-WORDS_PER_BLOCK = BYTES_PER_BLOCK // BYTES_PER_WORD
-
-def block_from_ptr(area, ptr):
-    return (int(ptr) - int(area["gc_pool_start"])) // BYTES_PER_BLOCK
-def ptr_from_block(area, block):
-    return area["gc_pool_start"][block * BYTES_PER_BLOCK].address
-def get_ptr_area(mem_state, ptr, aligned=True) -> tuple[int,Any]:
-    ptr = int(ptr)
-    if aligned:
-        if ptr & (BYTES_PER_BLOCK - 1) != 0:
-            return None # must be aligned on a block
-    for area_num, heap_area in enumerate(all_heap_areas(mem_state)):
-        start = int(heap_area["gc_pool_start"])
-        end = int(heap_area["gc_pool_end"])
-        if start <= ptr and ptr < end:
-            return area_num, heap_area
-    else:
-        return None
-
-def get_previous_head(area, block):
-    orig_block = block
-    while block >= 0:
-        kind = ATB.lookup(area, block)
-        if kind == ATB.FREE:
-            return orig_block
-        elif kind == ATB.TAIL:
-            block -= 1
-        else: #if kind in {ATB.HEAD, ATB.MARK}:
-            return block
-    else:
-        return orig_block
-    
-def enumerate_ptrs_in_block(mem_state, area, block):
-    for i in range(WORDS_PER_BLOCK):
-        src_ptr = area["gc_pool_start"][block*BYTES_PER_BLOCK + i*BYTES_PER_WORD].address
-        dst_ptr = src_ptr.cast(gdb.lookup_type("uintptr_t").pointer())[0]
-        if get_ptr_area(mem_state, dst_ptr, aligned=True):
-            yield (i, src_ptr, dst_ptr)
+ATB = heap.ATB
+FTB = heap.FTB
+BYTES_PER_WORD = heap.BYTES_PER_WORD
+BYTES_PER_BLOCK = heap.BYTES_PER_BLOCK
+WORDS_PER_BLOCK = heap.WORDS_PER_BLOCK
 
 def heap_stats_node(mem_state):
     entries = []
@@ -479,13 +561,21 @@ def heap_stats_node(mem_state):
         value = int(mem_state[stat])
         entries.append(f"<dt>{stat_short}</dt><dd>{value}</dd>")
     label = "<<dl>" + "".join(entries) + "</dl>>"
-    return pydot.Node("stats", shape="plaintext", label=label)
+    return ("stats", dict(shape="plaintext", label=label))
 
-def get_immediate(ptr) -> str|None:
+def get_qstr(qstr, snapshot:heap.HeapSnapshot|None=None) -> str|None:
+    if snapshot is not None and not snapshot.live:
+        return snapshot.qstr(int(qstr))
+    try:
+        return mpgdb.qstr.string(int(qstr))
+    except gdb.error:
+        return None
+
+def get_immediate(ptr, snapshot:heap.HeapSnapshot|None=None) -> str|None:
     if int(ptr) & 1:
         return f"mp_int({str(int(ptr) >> 1)})"
     elif (int(ptr) & 7) == 2:
-        qstr = get_qstr(int(ptr) >> 3)
+        qstr = get_qstr(int(ptr) >> 3, snapshot)
         if qstr:
             return f"mp_qstr({qstr!r})"
         else:
@@ -505,19 +595,53 @@ def get_immediate(ptr) -> str|None:
     else:
         return None
     
-def get_heap_type(ptr) -> str|None:
-    value = get_immediate(ptr)
+# (key, names) for the last heap scanned: the memory cache generation for a
+# live snapshot, so captures between two stops share it, or the loaded snapshot.
+_heap_type_names: tuple[object, dict[int,str]|None] = (None, None)
+
+def get_heap_type_names(snapshot:heap.HeapSnapshot) -> dict[int,str]:
+    """Classes defined at runtime, i.e. heap objects whose type is `type`."""
+    global _heap_type_names
+    key = mem.cache.generation if snapshot.live else snapshot
+    cached_key, names = _heap_type_names
+    if names is None or cached_key != key:
+        names = {}
+        type_type = mp.type._get("type")
+        if type_type is not None:
+            name_field = next(f for f in mp.obj.type.target().strip_typedefs().fields() if f.name == "name")
+            offset = name_field.bitpos // 8
+            size = name_field.type.sizeof
+            for area in snapshot.areas:
+                for head in area.heads_of_type(int(type_type)):
+                    start = head * BYTES_PER_BLOCK + offset
+                    qstr = int.from_bytes(area.pool[start:start + size], "little")
+                    names[area.ptr_from_block(head)] = get_qstr(qstr, snapshot) or f"<class qstr {qstr}>"
+        _heap_type_names = (key, names)
+    return names
+
+def get_type_name(objtype, snapshot:heap.HeapSnapshot|None=None) -> str|None:
+    objtype = int(objtype)
+    name = mp.type_names().get(objtype)
+    if name is None and snapshot is not None:
+        name = get_heap_type_names(snapshot).get(objtype)
+    return name
+
+def get_heap_type(snapshot:heap.HeapSnapshot, ptr) -> str|None:
+    value = get_immediate(ptr, snapshot)
     if value is not None:
         return value
-    
-    objtype = ptr.cast(mp.obj.base_t)["type"]
-    for typename in mp.type.NAMES:
-        try:
-            mptype = mp.type._lookup(typename)
-        except KeyError:
-            continue
-        if int(objtype) == int(mptype):
-            return typename
+
+    area = snapshot.get_ptr_area(ptr, aligned=False)
+    if area is not None:
+        objtype = area.word(area.block_from_ptr(ptr), 0)
+    else:
+        objtype = ptr.cast(mp.obj.base_t)["type"]
+    return get_type_name(objtype, snapshot)
+
+def get_struct_type(obj) -> str|None:
+    fields = obj.type.strip_typedefs().fields()
+    if fields and fields[0].name == "base":
+        return get_type_name(obj["base"]["type"])
     return None
 
 def get_block_anchor(area_num, block):
@@ -525,93 +649,76 @@ def get_block_anchor(area_num, block):
 def get_node_name(ptr):
     return f"{int(ptr):#08x}"
 
-def get_pointer_edge_ref(mem_state, ptr, heap_only=False):
-    ptr_area = get_ptr_area(mem_state, ptr, False)
-    if ptr_area:
-        area_num, area = ptr_area
-        block = block_from_ptr(area, ptr)
-        head_block = get_previous_head(area, block)
-        head_ptr = ptr_from_block(area, head_block)
-        return f"{int(head_ptr):#08x}:a{area_num}.b{block}"
+def get_pointer_edge_ref(snapshot:heap.HeapSnapshot, ptr, heap_only=False):
+    area = snapshot.get_ptr_area(ptr, False)
+    if area:
+        block = area.block_from_ptr(ptr)
+        head_block = area.previous_head(block)
+        head_ptr = area.ptr_from_block(head_block)
+        return f"{int(head_ptr):#08x}:a{area.num}.b{block}"
     elif not heap_only:
         return f"{int(ptr):#08x}"
     else:
         return None
 
-def add_heap_ptr(dot_graph:pydot.Graph, mem_state, src_ref:str, dst_ptr, heap_only=False):
+def add_heap_ptr(graph:dot.DotWriter, snapshot:heap.HeapSnapshot, src_ref:str, dst_ptr, heap_only=False):
     if int(dst_ptr) == 0:
         # dst_ref = "null_" + src_ref.split(":")[0]
-        # dot_graph.add_node(pydot.Node(dst_ref, shape="plaintext", label="null"))
+        # graph.add_node(dst_ref, shape="plaintext", label="null")
         return False
     else:
-        dst_ref = get_pointer_edge_ref(mem_state, dst_ptr, heap_only=heap_only)
+        dst_ref = get_pointer_edge_ref(snapshot, dst_ptr, heap_only=heap_only)
     if dst_ref is not None:
-        dot_graph.add_edge(pydot.Edge(src_ref, dst_ref))
+        graph.add_edge(src_ref, dst_ref)
         return True
     else:
         return False
 
-def add_mem_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state):
-    sub_nodes = pydot.Subgraph("heap", cluster=True, color="blue", label="heap")
-    nodes.add_subgraph(sub_nodes)
-
-    for area_num, area in enumerate(all_heap_areas(mem_state)):
-
-        atb_len = int(area["gc_alloc_table_byte_len"])
-        block_count = atb_len * ATB.blocks_per_byte
-
-        head_ptr = None
-        node_lines = None
-
-        for block in range(block_count):
-            ptr = ptr_from_block(area, block)
-            kind = ATB.lookup(area, block)
-
-            if kind in {ATB.HEAD, ATB.MARK, ATB.FREE}: # chain ends, write out current and clear
-                if head_ptr is not None:
-                    head_block = block_from_ptr(area, head_ptr)
-                    head_kind = ATB.lookup(area, head_block)
-                    head_final = FTB.lookup(area, head_block)
-                    
-                    fillcolor = {
-                        ATB.FREE: "gray",
-                        ATB.HEAD: "aliceblue",
-                        ATB.TAIL: "lightgray",
-                        ATB.MARK: "lightcoral",
-                    }[head_kind]
-                    style = '"filled,dashed"' if head_final == FTB.SET else "filled"
-
-                    node = pydot.Node(
-                        get_node_name(head_ptr),
-                        label='"' + "|".join(node_lines) + '"',
-                        shape="record", style=style, fillcolor=fillcolor,
-                        sortv=int(head_ptr),
-                    )
-                    sub_nodes.add_node(node)
-                head_ptr = None
-                node_lines = None
-            
-            if kind in {ATB.HEAD, ATB.MARK, ATB.TAIL}: # add to chain
-                anchor = get_block_anchor(area_num, block)
-                if head_ptr is None:
-                    head_ptr = ptr
-                    node_lines = []
-                    name = get_node_name(ptr)
-                    obj = get_heap_type(ptr)
-                    if obj:
-                        line = f"{anchor}{name}\\n{obj}"
+def add_mem_blocks(graph:dot.DotWriter, snapshot:heap.HeapSnapshot):
+    with graph.subgraph("heap", cluster=True, color="blue", label="heap"):
+        for area in snapshot.areas:
+            heads, lengths = area.runs(include_orphans=True)
+            for head_block, length in zip(heads, lengths):
+                head_block = int(head_block)
+                head_ptr = area.ptr_from_block(head_block)
+                head_kind = int(area.atb_kinds[head_block])
+                head_final = int(area.ftb_kinds[head_block])
+
+                node_lines = []
+                for block in range(head_block, head_block + int(length)):
+                    anchor = get_block_anchor(area.num, block)
+                    if block == head_block:
+                        name = get_node_name(head_ptr)
+                        obj = get_heap_type(snapshot, head_ptr)
+                        if obj:
+                            line = f"{anchor}{name}\\n{obj}"
+                        else:
+                            line = f"{anchor}{name}"
                     else:
-                        line = f"{anchor}{name}"
-                else:
-                    line = anchor
-                node_lines.append(line)
-
-                # add all pointers in the block
-                for i, src_ptr, dst_ptr in enumerate_ptrs_in_block(mem_state, area, block):
-                    src_name = get_pointer_edge_ref(mem_state, src_ptr)
-                    # src_name = f"{int(head_ptr):#08x}:a{area_num}.b{block}"
-                    dst_name = get_pointer_edge_ref(mem_state, dst_ptr)
-                    edges.add_edge(pydot.Edge(src_name, dst_name))
+                        line = anchor
+                    node_lines.append(line)
+
+                    # add all pointers in the block
+                    for i, src_ptr, dst_ptr in snapshot.enumerate_ptrs_in_block(area, block):
+                        src_name = get_pointer_edge_ref(snapshot, src_ptr)
+                        # src_name = f"{int(head_ptr):#08x}:a{area_num}.b{block}"
+                        dst_name = get_pointer_edge_ref(snapshot, dst_ptr)
+                        graph.add_edge(src_name, dst_name)
+
+                fillcolor = {
+                    ATB.FREE: "gray",
+                    ATB.HEAD: "aliceblue",
+                    ATB.TAIL: "lightgray",
+                    ATB.MARK: "lightcoral",
+                }[head_kind]
+                style = '"filled,dashed"' if head_final == FTB.SET else "filled"
+
+                graph.add_node(
+                    get_node_name(head_ptr),
+                    label='"' + "|".join(node_lines) + '"',
+                    shape="record", style=style, fillcolor=fillcolor,
+                    sortv=int(head_ptr),
+                )
 
 def struct_get_checked(parent_struct, name, unless_disabled=None):
     try:
@@ -623,14 +730,14 @@ def struct_get_checked(parent_struct, name, unless_disabled=None):
         else:
             raise e
 
-def add_ptr_block(edges:pydot.Graph, nodes:pydot.Graph, mem_state, parent_struct, name:str, unless_disabled=None):
+def add_ptr_block(graph:dot.DotWriter, snapshot, parent_struct, name:str, unless_disabled=None):
     ptr = struct_get_checked(parent_struct, name, unless_disabled)
     if ptr is None:
         return
-    nodes.add_node(pydot.Node(name, shape="record"))
-    add_heap_ptr(edges, mem_state, name, ptr)
+    graph.add_node(name, shape="record")
+    add_heap_ptr(graph, snapshot, name, ptr)
 
-def add_array_block(edges:pydot.Graph, nodes:pydot.Graph, mem_state, parent_struct, name:str, unless_disabled=None):
+def add_array_block(graph:dot.DotWriter, snapshot, parent_struct, name:str, unless_disabled=None):
     arr = struct_get_checked(parent_struct, name, unless_disabled)
     if arr is None:
         return
@@ -638,31 +745,30 @@ def add_array_block(edges:pydot.Graph, nodes:pydot.Graph, mem_state, parent_stru
     lines = []
     for i in range(arr_size):
         lines.append(f"<i{i}>")
-        add_heap_ptr(edges, mem_state, f"{name}:i{i}", arr[i])
+        add_heap_ptr(graph, snapshot, f"{name}:i{i}", arr[i])
     lines[0] = f"{lines[0]}{name}"
-    node = pydot.Node(
+    graph.add_node(
         name,
         label='"' + "|".join(lines) + '"',
         shape="record",
     )
-    nodes.add_node(node)
 
-def add_ptr_or_array_block(edges:pydot.Graph, nodes:pydot.Graph, mem_state, parent_struct, name:str, unless_disabled=None):
+def add_ptr_or_array_block(graph:dot.DotWriter, snapshot, parent_struct, name:str, unless_disabled=None):
     value = struct_get_checked(parent_struct, name, unless_disabled)
     if value is None:
         return
     if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
-        add_ptr_block(edges, nodes, mem_state, parent_struct, name)
+        add_ptr_block(graph, snapshot, parent_struct, name)
     else:
-        add_array_block(edges, nodes, mem_state, parent_struct, name)
+        add_array_block(graph, snapshot, parent_struct, name)
 
-def add_substruct_block(edges:pydot.Graph, nodes:pydot.Graph, mem_state, parent_struct, name:str, unless_disabled=None):
+def add_substruct_block(graph:dot.DotWriter, snapshot, parent_struct, name:str, unless_disabled=None):
     obj = struct_get_checked(parent_struct, name, unless_disabled)
     if obj is None:
         return
     lines = []
 
-    obj_type = get_heap_type(obj.address)
+    obj_type = get_struct_type(obj)
 
     for i, f in enumerate(obj.type.fields()):
         line_anchor= f"<{f.name}>"
@@ -678,48 +784,45 @@ def add_substruct_block(edges:pydot.Graph, nodes:pydot.Graph, mem_state, parent_
             value = obj[f.name]
 
             if f.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
-                add_heap_ptr(edges, mem_state, f"{name}:{f.name}", value)
+                add_heap_ptr(graph, snapshot, f"{name}:{f.name}", value)
                 line_lines.append(f"*{f.name}")
             else:
-                line_lines.append(f"{f.name} = {value!s}")
+                # Pretty printers read target memory (qstr pools, map tables) a loaded snapshot does not have.
+                text = str(value) if snapshot.live else value.format_string(raw=True)
+                line_lines.append(f"{f.name} = {text}")
         lines.append(line_anchor + '\\n'.join(line_lines))
     
-    node = pydot.Node(
+    graph.add_node(
         name,
         label='"' + "|".join(lines) + '"',
         shape="record",
     )
-    nodes.add_node(node)
-
-def add_thread_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state, thread_state):
-    sub_nodes = pydot.Subgraph("thread", cluster=True, color="green", label="thread")
-    nodes.add_subgraph(sub_nodes)
-
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "dict_locals")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "dict_globals")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "nlr_top")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "nlr_jump_callback_top")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "mp_pending_exception")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "stop_iteration_arg")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "prof_trace_callback", unless_disabled="MICROPY_PY_SYS_SETTRACE")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "current_code_state", unless_disabled="MICROPY_PY_SYS_SETTRACE")
-    add_ptr_block(edges, sub_nodes, mem_state, thread_state, "tls_ssl_context", unless_disabled="MICROPY_PY_SSL_MBEDTLS_NEED_ACTIVE_CONTEXT")
-
-def add_vm_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state, vm_state):
-    sub_nodes = pydot.Subgraph("vm", cluster=True, color="red", label="vm")
-    nodes.add_subgraph(sub_nodes)
-
-    add_ptr_block(edges, sub_nodes, mem_state, vm_state, "last_pool")
-    add_ptr_block(edges, sub_nodes, mem_state, vm_state, "m_tracked_head", unless_disabled="MICROPY_TRACKED_ALLOC")
-    add_substruct_block(edges, sub_nodes, mem_state, vm_state, "mp_emergency_exception_obj")
-    add_ptr_or_array_block(edges, sub_nodes, mem_state, vm_state, "mp_emergency_exception_buf", unless_disabled="MICROPY_ENABLE_EMERGENCY_EXCEPTION_BUF")
-    add_substruct_block(edges, sub_nodes, mem_state, vm_state, "mp_kbd_exception", unless_disabled="MICROPY_KBD_EXCEPTION")
-    add_substruct_block(edges, sub_nodes, mem_state, vm_state, "mp_loaded_modules_dict")
-    add_substruct_block(edges, sub_nodes, mem_state, vm_state, "dict_main")
-    add_ptr_block(edges, sub_nodes, mem_state, vm_state, "mp_module_builtins_override_dict", unless_disabled="MICROPY_CAN_OVERRIDE_BUILTINS")
-
-    add_registered_blocks(edges, sub_nodes, mem_state, vm_state)
-    add_sched_queue_blocks(edges, sub_nodes, mem_state, vm_state)
+
+def add_thread_blocks(graph:dot.DotWriter, snapshot, thread_state):
+    with graph.subgraph("thread", cluster=True, color="green", label="thread"):
+        add_ptr_block(graph, snapshot, thread_state, "dict_locals")
+        add_ptr_block(graph, snapshot, thread_state, "dict_globals")
+        add_ptr_block(graph, snapshot, thread_state, "nlr_top")
+        add_ptr_block(graph, snapshot, thread_state, "nlr_jump_callback_top")
+        add_ptr_block(graph, snapshot, thread_state, "mp_pending_exception")
+        add_ptr_block(graph, snapshot, thread_state, "stop_iteration_arg")
+        add_ptr_block(graph, snapshot, thread_state, "prof_trace_callback", unless_disabled="MICROPY_PY_SYS_SETTRACE")
+        add_ptr_block(graph, snapshot, thread_state, "current_code_state", unless_disabled="MICROPY_PY_SYS_SETTRACE")
+        add_ptr_block(graph, snapshot, thread_state, "tls_ssl_context", unless_disabled="MICROPY_PY_SSL_MBEDTLS_NEED_ACTIVE_CONTEXT")
+
+def add_vm_blocks(graph:dot.DotWriter, snapshot, vm_state):
+    with graph.subgraph("vm", cluster=True, color="red", label="vm"):
+        add_ptr_block(graph, snapshot, vm_state, "last_pool")
+        add_ptr_block(graph, snapshot, vm_state, "m_tracked_head", unless_disabled="MICROPY_TRACKED_ALLOC")
+        add_substruct_block(graph, snapshot, vm_state, "mp_emergency_exception_obj")
+        add_ptr_or_array_block(graph, snapshot, vm_state, "mp_emergency_exception_buf", unless_disabled="MICROPY_ENABLE_EMERGENCY_EXCEPTION_BUF")
+        add_substruct_block(graph, snapshot, vm_state, "mp_kbd_exception", unless_disabled="MICROPY_KBD_EXCEPTION")
+        add_substruct_block(graph, snapshot, vm_state, "mp_loaded_modules_dict")
+        add_substruct_block(graph, snapshot, vm_state, "dict_main")
+        add_ptr_block(graph, snapshot, vm_state, "mp_module_builtins_override_dict", unless_disabled="MICROPY_CAN_OVERRIDE_BUILTINS")
+
+        add_registered_blocks(graph, snapshot, vm_state)
+        add_sched_queue_blocks(graph, snapshot, vm_state)
 
 ALL_REGISTERED_ROOT_PTRS = set([
     "usbd",
@@ -815,103 +918,85 @@ ALL_REGISTERED_ROOT_STRUCTS = set([
     "mp_sys_argv_obj",
 ])
 # TODO how to handle: MP_REGISTER_ROOT_POINTER(const char *readline_hist[MICROPY_READLINE_HISTORY_SIZE]);
-def add_registered_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state, vm_state):
-    sub_nodes = pydot.Subgraph("registered", cluster=True, color="red", style="dashed", label="MP_REGISTER_ROOT_POINTER")
-    nodes.add_subgraph(sub_nodes)
-
-    for ptr_name in ALL_REGISTERED_ROOT_PTRS:
-        add_ptr_block(edges, sub_nodes, mem_state, vm_state, ptr_name, unless_disabled=ptr_name)
-    for array_name in ALL_REGISTERED_ROOT_ARRAYS:
-        add_array_block(edges, sub_nodes, mem_state, vm_state, array_name, unless_disabled=array_name)
-    for struct_name in ALL_REGISTERED_ROOT_STRUCTS:
-        add_substruct_block(edges, sub_nodes, mem_state, vm_state, struct_name, unless_disabled=struct_name)
-
-def add_sched_queue_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state, vm_state):
-    sub_nodes = pydot.Subgraph("sched_queue", cluster=True, color="black", label="sched_queue")
-    nodes.add_subgraph(sub_nodes)
-
-    sched_queue = struct_get_checked(vm_state, "sched_queue", unless_disabled="MICROPY_ENABLE_SCHEDULER")
-    if sched_queue == None:
-        return
-    sched_queue_size = sched_queue.type.sizeof // sched_queue[0].type.sizeof
-
-    for i in range(sched_queue_size):
-        sched_item = sched_queue[i]
-        node = pydot.Node(
-            f"sched_item_{i}",
-            label=f'"<func>sched_queue[{i}]\\nfunc|<arg>arg"',
-            shape="record",
-        )
-        sub_nodes.add_node(node)
-        add_heap_ptr(edges, mem_state, f"sched_item_{i}:func", sched_item["func"])
-        add_heap_ptr(edges, mem_state, f"sched_item_{i}:arg", sched_item["arg"])
-
-def add_cpu_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state):
-    sub_nodes = pydot.Subgraph("cpu", cluster=True, color="purple", label="cpu")
-    nodes.add_subgraph(sub_nodes)
-
-    for reg in gdb.selected_inferior().architecture().registers("general"):
-        value = gdb.newest_frame().read_register(reg)
-        imm_val = get_immediate(value)
-        
-        if imm_val is None:
-            node = pydot.Node(
-                f"{reg.name}",
-                shape="record",
-            )
-            add_heap_ptr(edges, mem_state, f"{reg.name}", value)
-        else:
-            node = pydot.Node(
-                f"{reg.name}",
-                label=f"{reg.name}\\n{imm_val}",
+def add_registered_blocks(graph:dot.DotWriter, snapshot, vm_state):
+    with graph.subgraph("registered", cluster=True, color="red", style="dashed", label="MP_REGISTER_ROOT_POINTER"):
+        for ptr_name in ALL_REGISTERED_ROOT_PTRS:
+            add_ptr_block(graph, snapshot, vm_state, ptr_name, unless_disabled=ptr_name)
+        for array_name in ALL_REGISTERED_ROOT_ARRAYS:
+            add_array_block(graph, snapshot, vm_state, array_name, unless_disabled=array_name)
+        for struct_name in ALL_REGISTERED_ROOT_STRUCTS:
+            add_substruct_block(graph, snapshot, vm_state, struct_name, unless_disabled=struct_name)
+
+def add_sched_queue_blocks(graph:dot.DotWriter, snapshot, vm_state):
+    with graph.subgraph("sched_queue", cluster=True, color="black", label="sched_queue"):
+        sched_queue = struct_get_checked(vm_state, "sched_queue", unless_disabled="MICROPY_ENABLE_SCHEDULER")
+        if sched_queue == None:
+            return
+        sched_queue_size = sched_queue.type.sizeof // sched_queue[0].type.sizeof
+
+        for i in range(sched_queue_size):
+            sched_item = sched_queue[i]
+            graph.add_node(
+                f"sched_item_{i}",
+                label=f'"<func>sched_queue[{i}]\\nfunc|<arg>arg"',
                 shape="record",
             )
-        sub_nodes.add_node(node)
-
-def add_stack_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state, thread_state):
-    sub_nodes = pydot.Subgraph("stack", cluster=True, color="maroon", label="stack")
-    nodes.add_subgraph(sub_nodes)
-
-    frame = gdb.selected_frame()
-    frame_nodes = pydot.Subgraph(f"level{frame.level()}", cluster=True, color="maroon", style="dashed", label=f"level{frame.level()}")
-    sub_nodes.add_subgraph(frame_nodes)
-
-    stack_top = thread_state["stack_top"]
-    stack_bot = frame.read_register("sp")
-    stack_bot = stack_bot - (int(stack_bot) % BYTES_PER_WORD)
-
-    stack = stack_bot.cast(gdb.lookup_type("uintptr_t").pointer())
-    stack_size = int(stack_top - stack_bot) // BYTES_PER_WORD
+            add_heap_ptr(graph, snapshot, f"sched_item_{i}:func", sched_item["func"])
+            add_heap_ptr(graph, snapshot, f"sched_item_{i}:arg", sched_item["arg"])
 
-    for i in range(stack_size):
-        value = stack[i]
-        name = get_pointer_edge_ref(mem_state, value.address)
-        imm_val = get_immediate(value)
-        
-        try:
-            if value.address >= frame.older().read_register("sp"):
-                frame = frame.older()
-                frame_nodes = pydot.Subgraph(f"level{frame.level()}", cluster=True, color="maroon", style="dashed", label=f"level{frame.level()}")
-                sub_nodes.add_subgraph(frame_nodes)
-        except AttributeError:
-            pass
-
-        node = None
-        if imm_val is None:
-            if add_heap_ptr(edges, mem_state, name, value, heap_only=True):
-                node = pydot.Node(
-                    name,
+def add_cpu_blocks(graph:dot.DotWriter, snapshot):
+    with graph.subgraph("cpu", cluster=True, color="purple", label="cpu"):
+        for reg_name, value in snapshot.registers.items():
+            imm_val = get_immediate(value, snapshot)
+            
+            if imm_val is None:
+                graph.add_node(
+                    f"{reg_name}",
                     shape="record",
                 )
-        else:
-            pass
-            # node = pydot.Node(
-            #     name,
-            #     label=f"{name}\\n{imm_val}",
-            #     shape="record",
-            # )
-        if node:
-            frame_nodes.add_node(node)
+                add_heap_ptr(graph, snapshot, f"{reg_name}", value)
+            else:
+                graph.add_node(
+                    f"{reg_name}",
+                    label=f"{reg_name}\\n{imm_val}",
+                    shape="record",
+                )
+
+def add_stack_blocks(graph:dot.DotWriter, snapshot):
+    with graph.subgraph("stack", cluster=True, color="maroon", label="stack"):
+        stack_bot = snapshot.stack_bottom
+        stack = snapshot.stack
+        stack_size = len(stack) // BYTES_PER_WORD
+
+        frames = snapshot.frames
+        for frame_num, (level, sp) in enumerate(frames):
+            if frame_num + 1 < len(frames):
+                frame_end = frames[frame_num + 1][1]
+            else:
+                frame_end = snapshot.stack_top
+            first = max(sp - stack_bot, 0) // BYTES_PER_WORD if frame_num else 0
+            last = min((frame_end - stack_bot) // BYTES_PER_WORD, stack_size)
+
+            with graph.subgraph(f"level{level}", cluster=True, color="maroon", style="dashed", label=f"level{level}"):
+                for i in range(first, last):
+                    address = stack_bot + i * BYTES_PER_WORD
+                    value = int.from_bytes(stack[i * BYTES_PER_WORD:(i + 1) * BYTES_PER_WORD], "little")
+                    name = get_pointer_edge_ref(snapshot, address)
+                    imm_val = get_immediate(value, snapshot)
+
+                    if imm_val is None:
+                        if add_heap_ptr(graph, snapshot, name, value, heap_only=True):
+                            graph.add_node(
+                                name,
+                                shape="record",
+                            )
+                    else:
+                        pass
+                        # graph.add_node(
+                        #     name,
+                        #     label=f"{name}\\n{imm_val}",
+                        #     shape="record",
+                        # )
 
 def all_pthreads():
     try:
@@ -922,67 +1007,305 @@ def all_pthreads():
         yield thread[0]
         thread = thread[0]['next']
 
-def add_pthread_blocks(edges:pydot.Graph, nodes:pydot.Graph, mem_state):
-    sub_nodes = pydot.Subgraph("stack", cluster=True, color="chartreuse", label="pthreads")
-    nodes.add_subgraph(sub_nodes)
-
-    for thread in all_pthreads():
-        # log.warning("thread = %r", thread)
-        name = get_pointer_edge_ref(mem_state, thread.address)
-        tid = int(thread['id'])
-        arg = thread['arg']
-
-        node = pydot.Node(
-            name,
-            label=f"pthread {tid}|<arg>arg",
-            shape="record",
-        )
-        sub_nodes.add_node(node)
-        add_heap_ptr(edges, mem_state, f"{name}:arg", arg, heap_only=True)
-
-        # TODO: get other threads' register contents?
+def add_pthread_blocks(graph:dot.DotWriter, snapshot):
+    with graph.subgraph("stack", cluster=True, color="chartreuse", label="pthreads"):
+        for thread in all_pthreads():
+            # log.warning("thread = %r", thread)
+            name = get_pointer_edge_ref(snapshot, thread.address)
+            tid = int(thread['id'])
+            arg = thread['arg']
+
+            graph.add_node(
+                name,
+                label=f"pthread {tid}|<arg>arg",
+                shape="record",
+            )
+            add_heap_ptr(graph, snapshot, f"{name}:arg", arg, heap_only=True)
+
+            # TODO: get other threads' register contents?
         
 
-def print_heap_graph(print):
-    dot_graph = pydot.Dot("Heap", graph_type="digraph", fontname="Helvetica,Arial,sans-serif", layout="dot", ranksep="2.0")
-    dot_graph.set_graph_defaults(rankdir="LR")
-    dot_graph.set_node_defaults(fontsize="16", shape="ellipse", fontname="Helvetica,Arial,sans-serif")
-    dot_graph.set_edge_defaults(fontname="Helvetica,Arial,sans-serif")
-
-    state = gdb.lookup_symbol("mp_state_ctx")[0].value()
-    mem_state = state["mem"]
-    thread_state = state["thread"]
-    vm_state = state["vm"]
-
-    add_mem_blocks(dot_graph, dot_graph, mem_state)
-    add_thread_blocks(dot_graph, dot_graph, mem_state, thread_state)
-    add_vm_blocks(dot_graph, dot_graph, mem_state, vm_state)
-    add_cpu_blocks(dot_graph, dot_graph, mem_state)
-    add_stack_blocks(dot_graph, dot_graph, mem_state, thread_state)
-    add_pthread_blocks(dot_graph, dot_graph, mem_state)
-    
+def write_heap_graph(out, snapshot:heap.HeapSnapshot):
+    graph = dot.DotWriter(out, "Heap", graph_type="digraph", fontname="Helvetica,Arial,sans-serif", layout="dot", ranksep="2.0")
+    graph.set_graph_defaults(rankdir="LR")
+    graph.set_node_defaults(fontsize="16", shape="ellipse", fontname="Helvetica,Arial,sans-serif")
+    graph.set_edge_defaults(fontname="Helvetica,Arial,sans-serif")
 
-    print(dot_graph)
-    # return dot_graph
+    thread_state = snapshot.state["thread"]
+    vm_state = snapshot.state["vm"]
+
+    add_mem_blocks(graph, snapshot)
+    add_thread_blocks(graph, snapshot, thread_state)
+    add_vm_blocks(graph, snapshot, vm_state)
+    add_cpu_blocks(graph, snapshot)
+    add_stack_blocks(graph, snapshot)
+    if snapshot.live:
+        add_pthread_blocks(graph, snapshot)
+
+    graph.close()
 
 
 class MpyHeap(gdb.Command):
-    """Dissasemble MicroPython bytecode.
-    Usage: mpy heap
+    """Graph the MicroPython heap in DOT format.
+    Usage: mpy heap [FILE]
+    Writes to FILE if given, otherwise to the console.
+    Uses the snapshot from `mpy heap load` if one is loaded.
     """
     def __init__(self):
-        super(MpyHeap, self).__init__("mpy heap", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        super(MpyHeap, self).__init__("mpy heap", gdb.COMMAND_DATA, gdb.COMPLETE_FILENAME, True)
         log.info("Registered command: mpy heap")
 
     def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) > 1:
+            raise gdb.GdbError("Usage: mpy heap [FILE]")
         try:
-            print_heap_graph(print)
+            snapshot = heap.current()
+            if argv:
+                with open(argv[0], "w") as out:
+                    write_heap_graph(out, snapshot)
+            else:
+                write_heap_graph(sys.stdout, snapshot)
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
 
-if has_pydot:
-    MpyHeap()
+class MpyHeapSave(gdb.Command):
+    """Save a snapshot of the MicroPython heap and its roots to a file.
+    Usage: mpy heap save FILE
+    """
+    def __init__(self):
+        super(MpyHeapSave, self).__init__("mpy heap save", gdb.COMMAND_DATA, gdb.COMPLETE_FILENAME)
+        log.info("Registered command: mpy heap save")
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) != 1:
+            raise gdb.GdbError("Usage: mpy heap save FILE")
+        heap.HeapSnapshot.capture(include_qstrs=True).save(argv[0])
+
+class MpyHeapLoad(gdb.Command):
+    """Load a heap snapshot; heap commands then read it instead of the target.
+    Usage: mpy heap load FILE
+           mpy heap load          (go back to reading the target)
+    """
+    def __init__(self):
+        super(MpyHeapLoad, self).__init__("mpy heap load", gdb.COMMAND_DATA, gdb.COMPLETE_FILENAME)
+        log.info("Registered command: mpy heap load")
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) > 1:
+            raise gdb.GdbError("Usage: mpy heap load [FILE]")
+        heap.set_loaded(heap.HeapSnapshot.load(argv[0]) if argv else None)
+
+class MpyHeapMark(gdb.Command):
+    """Record a fingerprint of every heap allocation, for a later `mpy heap diff`.
+    Usage: mpy heap mark [NAME]
+    NAME defaults to the lowest number from the count of marks up that is not taken.
+    """
+    def __init__(self):
+        super(MpyHeapMark, self).__init__("mpy heap mark", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy heap mark")
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) > 1:
+            raise gdb.GdbError("Usage: mpy heap mark [NAME]")
+        if argv:
+            name = argv[0]
+        else:
+            name = next(str(n) for n in itertools.count(len(heap.marks)) if str(n) not in heap.marks)
+        # Re-marking a name moves it to the end, so it is the latest mark for `mpy heap diff`.
+        heap.marks.pop(name, None)
+        heap.marks[name] = fingerprint = heap.HeapFingerprint(heap.current())
+        print(f"Marked {len(fingerprint)} allocations as {name!r}.")
+
+class MpyHeapDiff(gdb.Command):
+    """Report heap allocations that changed since a `mpy heap mark`, grouped by type.
+    Usage: mpy heap diff [-l] [NAME]
+    NAME defaults to the most recent mark. With -l, list every changed allocation.
+    """
+    def __init__(self):
+        super(MpyHeapDiff, self).__init__("mpy heap diff", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy heap diff")
+
+    def complete(self, text, word):
+        return [name for name in heap.marks if name.startswith(word)]
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        list_all = "-l" in argv
+        argv = [arg for arg in argv if arg != "-l"]
+        if len(argv) > 1:
+            raise gdb.GdbError("Usage: mpy heap diff [-l] [NAME]")
+        if not heap.marks:
+            raise gdb.GdbError("No marks, use `mpy heap mark` first.")
+        name = argv[0] if argv else next(reversed(heap.marks))
+        try:
+            old = heap.marks[name]
+        except KeyError:
+            raise gdb.GdbError(f"No mark named {name!r}.")
+
+        snapshot = heap.current()
+        changes = heap.diff(old, heap.HeapFingerprint(snapshot))
+
+        by_type = {}
+        for change, address, old_blocks, new_blocks, objtype in changes:
+            type_name = get_type_name(objtype, snapshot) or "?"
+            counts = by_type.setdefault(type_name, {kind: [0, 0] for kind in heap.HeapChange})
+            counts[change][0] += 1
+            counts[change][1] += (new_blocks - old_blocks) * BYTES_PER_BLOCK
+            if list_all:
+                print(f"{change.value:8} {address:#010x} {old_blocks:5} -> {new_blocks:5} blocks  {type_name}")
+
+        print(f"Changes since mark {name!r}:")
+        print(f"{'type':24}" + "".join(f"{kind.value:>18}" for kind in heap.HeapChange))
+        for type_name, counts in sorted(by_type.items(), key=lambda item: -sum(c[1] for c in item[1].values())):
+            cells = "".join(f"{count:>7} {delta:>+10}" for count, delta in counts.values())
+            print(f"{type_name:24}{cells}")
+
+class MpyHeapStats(gdb.Command):
+    """Summarise heap usage without calling into the target.
+    Usage: mpy heap stats
+    Reports what gc_dump_info does, plus allocation counts and sizes by type,
+    a size histogram, finaliser count and fragmentation.
+    """
+    def __init__(self):
+        super(MpyHeapStats, self).__init__("mpy heap stats", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy heap stats")
+
+    def invoke(self, args, from_tty):
+        if gdb.string_to_argv(args):
+            raise gdb.GdbError("Usage: mpy heap stats")
+        snapshot = heap.current()
+        stats = heap.HeapStats(snapshot)
+
+        print(f"GC: total: {stats.total_blocks * BYTES_PER_BLOCK}, used: {stats.used_blocks * BYTES_PER_BLOCK}, free: {stats.free_blocks * BYTES_PER_BLOCK}")
+        print(f" No. of 1-blocks: {stats.one_block}, 2-blocks: {stats.two_block}, max blk sz: {stats.max_block}, max free sz: {stats.max_free}")
+        print(f" allocations: {stats.allocations}, finalisers: {stats.finalisers}, fragmentation: {stats.fragmentation:.3f}")
+
+        print()
+        print(f"{'blocks':>12} {'count':>8}")
+        for bucket, count in sorted(stats.sizes.items()):
+            print(f"{bucket:>5}-{2 * bucket - 1:<6} {count:>8}")
+
+        by_name = {}
+        for objtype, (count, blocks) in stats.types.items():
+            totals = by_name.setdefault(get_type_name(objtype, snapshot) or "?", [0, 0])
+            totals[0] += count
+            totals[1] += blocks
+
+        print()
+        print(f"{'type':24}{'count':>8}{'blocks':>10}{'bytes':>12}")
+        for type_name, (count, blocks) in sorted(by_name.items(), key=lambda item: -item[1][1]):
+            print(f"{type_name:24}{count:>8}{blocks:>10}{blocks * BYTES_PER_BLOCK:>12}")
+
+MpyHeap()
+MpyHeapSave()
+MpyHeapLoad()
+MpyHeapMark()
+MpyHeapDiff()
+MpyHeapStats()
+
+
+class MpyQstr(gdb.Command):
+    """Examine the interned string table.
+    Usage: mpy qstr
+    """
+    def __init__(self):
+        super(MpyQstr, self).__init__("mpy qstr", gdb.COMMAND_DATA, gdb.COMPLETE_NONE, True)
+        log.info("Registered command: mpy qstr")
+
+    def invoke(self, args, from_tty):
+        gdb.execute("help mpy qstr", from_tty)
+
+def print_qstr_summary(pools:list[mpgdb.qstr.PoolInfo]):
+    for dynamic in (False, True):
+        selected = [pool for pool in pools if pool.dynamic == dynamic]
+        count = sum(pool.count for pool in selected)
+        size = sum(pool.size for pool in selected)
+        label = "dynamic" if dynamic else "ROM"
+        print(f"{label}: {len(selected)} pools, {count} qstrs, {size} bytes")
+
+class MpyQstrDump(gdb.Command):
+    """Write every interned qstr with its hash, length and pool.
+    Usage: mpy qstr dump [FILE]
+    FILE is written as CSV if its name ends in .csv, otherwise as JSON.
+    Without FILE, the table is printed.
+    """
+    def __init__(self):
+        super(MpyQstrDump, self).__init__("mpy qstr dump", gdb.COMMAND_DATA, gdb.COMPLETE_FILENAME)
+        log.info("Registered command: mpy qstr dump")
+
+    def invoke(self, args, from_tty):
+        argv = gdb.string_to_argv(args)
+        if len(argv) > 1:
+            raise gdb.GdbError("Usage: mpy qstr dump [FILE]")
+        qstrs, pools = mpgdb.qstr.read_table()
+        if not argv:
+            for info in qstrs:
+                kind = "dyn" if info.dynamic else "rom"
+                print(f"{info.id:6} {kind} {info.length:5} {info.value!r}")
+        elif argv[0].endswith(".csv"):
+            with open(argv[0], "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(mpgdb.qstr.QstrInfo._fields)
+                writer.writerows(qstrs)
+        else:
+            with open(argv[0], "w") as f:
+                json.dump({
+                    "pools": [pool._asdict() for pool in pools],
+                    "qstrs": [info._asdict() for info in qstrs],
+                }, f, indent=1)
+        print_qstr_summary(pools)
+
+class MpyQstrFind(gdb.Command):
+    """List interned qstrs matching a regular expression.
+    Usage: mpy qstr find REGEX
+    """
+    def __init__(self):
+        super(MpyQstrFind, self).__init__("mpy qstr find", gdb.COMMAND_DATA, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy qstr find")
 
+    def invoke(self, args, from_tty):
+        if not args:
+            raise gdb.GdbError("Usage: mpy qstr find REGEX")
+        try:
+            pattern = re.compile(args)
+        except re.error as e:
+            raise gdb.GdbError(f"Bad regular expression: {e}")
+        qstrs, pools = mpgdb.qstr.read_table()
+        matches = [info for info in qstrs if pattern.search(info.value)]
+        for info in matches:
+            kind = "dyn" if info.dynamic else "rom"
+            print(f"{info.id:6} {kind} {info.value!r}")
+        print(f"{len(matches)} of {len(qstrs)} qstrs match")
+
+MpyQstr()
+MpyQstrDump()
+MpyQstrFind()
+
+class MpyStartupProfile(gdb.Command):
+    """Show where the plugin spent its load time, and what was loaded later on first use.
+    Usage: mpy startup-profile
+    """
+    def __init__(self):
+        super(MpyStartupProfile, self).__init__("mpy startup-profile", gdb.COMMAND_SUPPORT, gdb.COMPLETE_NONE)
+        log.info("Registered command: mpy startup-profile")
 
+    def invoke(self, args, from_tty):
+        if gdb.string_to_argv(args):
+            raise gdb.GdbError("Usage: mpy startup-profile")
+        for deferred, title in ((False, "At startup:"), (True, "Deferred to first use:")):
+            entries = [(name, seconds) for name, seconds, later in startup.timings if later == deferred]
+            print(title)
+            for name, seconds in entries:
+                print(f"  {seconds * 1000:9.1f} ms  {name}")
+            if not entries:
+                print("  (nothing)")
+
+MpyStartupProfile()
+
+startup.record("gdb-plugin.py (total)", time.perf_counter() - _plugin_start)
 log.info("Loaded MicroPython GDB Plugin")
\ No newline at end of file
@@ -1,5 +1,25 @@
 import logging
 log = logging.getLogger("mpgdb")
-from . import commands
-from . import mp
-from . import obj, qstr, map
\ No newline at end of file
+import importlib.util
+from . import startup
+
+# Worker processes import the gdb-free submodules (e.g. `bcdecode`) outside gdb.
+if importlib.util.find_spec("gdb") is not None:
+    with startup.timed("mpgdb.commands"):
+        from . import commands
+    with startup.timed("mpgdb.printers"):
+        from . import printers
+
+    # Pretty printers resolve their types when the first value is printed.
+    printers.defer("mpgdb.obj")
+    printers.defer("mpgdb.qstr")
+    printers.defer("mpgdb.map")
+
+_SUBMODULES = {"mp", "obj", "qstr", "map", "heap", "mem", "dot", "symcache", "depver", "file",
+               "startup", "elf", "dwarfmacro", "bytecode", "bcdecode"}
+
+def __getattr__(name:str):
+    # Other submodules are imported on first use, e.g. `mpgdb.qstr.string`.
+    if name in _SUBMODULES:
+        return startup.load(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,52 @@
+"""Bytecode decoding that needs neither gdb nor the rest of mpgdb.
+
+`bytecode.decode_all` runs `decode_job` in spawned worker processes, which
+import only this module and mpy-tool.
+"""
+import logging
+log = logging.getLogger("mpgdb.bcdecode")
+import importlib, os, sys
+from types import ModuleType
+
+def decode(code:bytes, start:int, mpy_tool) -> list[tuple[int,int,int,int,int]]:
+    """`(ip, opcode, format, size, arg)` of each instruction from `start` to the final return.
+
+    Works on a local buffer only, so it can run away from gdb.
+    """
+    Opcode = mpy_tool.Opcode
+    biggest_jump = 0
+    instructions = []
+    ip = start
+    while ip < len(code):
+        op = code[ip]
+        try:
+            fmt, sz, arg, _ = mpy_tool.mp_opcode_decode(code, ip)
+        except IndexError:
+            log.warning("Bytecode ends inside the instruction at offset %#x", ip)
+            break
+        if (op & 0xf0) == Opcode.MP_BC_BASE_JUMP_E:
+            biggest_jump = max(biggest_jump, ip + arg)
+        instructions.append((ip, op, fmt, sz, arg))
+        if op == Opcode.MP_BC_RETURN_VALUE and biggest_jump < ip:
+            break
+        ip += sz
+    return instructions
+
+_mpy_tool: ModuleType|None = None
+
+def init_worker(mpy_tool_path:str):
+    """Pool initializer: import mpy-tool from the file the parent process uses."""
+    global _mpy_tool
+    try:
+        _mpy_tool = importlib.import_module("mpy-tool")
+    except ImportError:
+        # As in `depver.import_mpytool`.
+        folder = os.path.dirname(mpy_tool_path)
+        if folder not in sys.path:
+            sys.path.append(folder)
+        sys.modules["makeqstrdata"] = {}
+        _mpy_tool = importlib.import_module("mpy-tool")
+
+def decode_job(job:tuple[bytes,int]) -> list[tuple[int,int,int,int,int]]:
+    code, start = job
+    return decode(code, start, _mpy_tool)
@@ -0,0 +1,408 @@
+import logging
+log = logging.getLogger("mpgdb.bytecode")
+import bisect, concurrent.futures, multiprocessing, os, shutil, sys
+import gdb
+from . import mem, heap, qstr, depver, elf, file, mp, bcdecode
+from .bcdecode import decode
+
+# Largest bytecode blob read in one go; a function's last instruction is found
+# by decoding, this only bounds the read.
+MAX_CODE_SIZE = 0x10000
+# Read size for bytecode that is neither on the heap nor in an ELF section.
+FALLBACK_CODE_SIZE = 1024
+# Fewer functions than this are decoded in-process; a process pool costs more to start.
+POOL_MIN_FUNCTIONS = 64
+
+# bytecode layout:
+#
+#  func signature  : var uint
+#      contains six values interleaved bit-wise as: xSSSSEAA [xFSSKAED repeated]
+#          x = extension           another byte follows
+#          S = n_state - 1         number of entries in Python value stack
+#          E = n_exc_stack         number of entries in exception stack
+#          F = scope_flags         four bits of flags, MP_SCOPE_FLAG_xxx
+#          A = n_pos_args          number of arguments this function takes
+#          K = n_kwonly_args       number of keyword-only arguments this function takes
+#          D = n_def_pos_args      number of default positional arguments
+#
+#  prelude size    : var uint
+#      contains two values interleaved bit-wise as: xIIIIIIC repeated
+#          x = extension           another byte follows
+#          I = n_info              number of bytes in source info section (always > 0)
+#          C = n_cells             number of bytes/cells in closure section
+#
+#  source info section:
+#      simple_name : var qstr      always exists
+#      argname0    : var qstr
+#      ...         : var qstr
+#      argnameN    : var qstr      N = num_pos_args + num_kwonly_args - 1
+#      <line number info>
+#
+#  closure section:
+#      local_num0  : byte
+#      ...         : byte
+#      local_numN  : byte          N = n_cells-1
+#
+#  <bytecode>
+class FunctionInfo:
+    """Prelude and line table of one bytecode function, decoded once."""
+    bytecode: int
+    allocation: tuple[int,int]|None
+    prelude: bytes
+    generation: int
+
+    def __init__(self, fun_bc:gdb.Value, snapshot:heap.HeapSnapshot|None=None):
+        mpy_tool = depver.mpytool()
+        self.bytecode = int(fun_bc["bytecode"])
+        constants = fun_bc["context"]["constants"]
+        self._qstr_table = _Table(constants["qstr_table"])
+        self._obj_table = _Table(constants["obj_table"])
+        self.code = code_bytes(self.bytecode, snapshot)
+        bytecode = self.code
+        sig = mpy_tool.extract_prelude(bytecode, 0)
+        (self.S, self.E, self.F, self.A, self.K, self.D) = sig[5]
+        (self.I, self.C) = sig[6]
+        self.end = sig[4]
+        names = self.qstrs(max(sig[7]) + 1)
+        self.function_name = names[sig[7][0]]
+        self.args = [names[int(i)] for i in sig[7][1:]]
+        self.source = names[0]
+
+        #now 1 qstr function name
+        #now A + K strings, args
+        self.lines = []
+        ptr = sig[2]
+        while ptr < sig[3]:
+            c = bytecode[ptr]
+            b = 0
+            l = 0
+            if (c & 0x80) == 0:
+                # 0b0LLBBBBB encoding
+                b = c & 0x1f
+                l = c >> 5
+                ptr += 1
+            else:
+                # 0b1LLLBBBB 0bLLLLLLLL encoding (l's LSB in second byte)
+                b = c & 0xf
+                l = ((c << 4) & 0x700) | bytecode[ptr + 1]
+                ptr += 2
+            self.lines.append((l,b))
+        self._index_lines()
+
+        self.prelude = bytecode[:self.end]
+        self.allocation = heap.allocation(self.bytecode)
+        self.generation = mem.cache.generation
+
+    def _index_lines(self):
+        """Turn the `(line delta, offset delta)` list into cumulative arrays and a reverse index.
+
+        `line_numbers[k]` applies from bytecode offset `line_offsets[k]`, like
+        `mp_bytecode_get_source_line`; offsets before the first entry are line 1.
+        """
+        self.line_offsets = []
+        self.line_numbers = []
+        offset = 0
+        line = 1
+        for (l, b) in self.lines:
+            offset += b
+            line += l
+            self.line_offsets.append(offset)
+            self.line_numbers.append(line)
+
+        # line -> [(start, end)], end None meaning the end of the function.
+        self.line_ranges: dict[int, list[tuple[int, int|None]]] = {}
+        starts = [0] + self.line_offsets
+        lines = [1] + self.line_numbers
+        for k, (start, line) in enumerate(zip(starts, lines)):
+            end = starts[k + 1] if k + 1 < len(starts) else None
+            if end == start:
+                continue
+            ranges = self.line_ranges.setdefault(line, [])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+
+    def map_line(self, ip:int) -> int:
+        """Source line of bytecode offset `ip`, counted from the first opcode."""
+        k = bisect.bisect_right(self.line_offsets, ip) - 1
+        return self.line_numbers[k] if k >= 0 else 1
+
+    def line_at(self, ip:int) -> int:
+        """Source line of the instruction at target address `ip`."""
+        return self.map_line(ip - self.bytecode - self.end)
+
+    def offsets_for_line(self, line:int) -> list[tuple[int, int|None]]:
+        """Bytecode offset ranges `[start, end)` compiled from source line `line`."""
+        return self.line_ranges.get(line, [])
+
+    def print(self):
+        print("state: " + str(self.S) + ", exc: " + str(self.E) + ", scope: " + str(self.F) + ", pos_args: " + str(self.A) + ", kwonly_args: " + str(self.K) + ", def_args: " + str(self.D) + ", info: " + str(self.I) + ", cells: " + str(self.C))
+
+    def qstrs(self, count:int) -> list[str|None]:
+        """The first `count` entries of the function's qstr table, as strings."""
+        return [qstr.string(value) for value in self._qstr_table.words(count)]
+
+    def objs(self, count:int) -> list[gdb.Value]:
+        """The first `count` entries of the function's constant object table."""
+        return self._obj_table.values(count)
+
+    def instructions(self) -> list[tuple[int,int,int,int,int]]:
+        return decode(self.code, self.end, depver.mpytool())
+
+class _Table:
+    """A constant table of the function's module, read with one read and grown on demand."""
+    def __init__(self, ptr:gdb.Value):
+        self.addr = int(ptr)
+        self.type = ptr.type.strip_typedefs().target()
+        self._data = b""
+
+    def _read(self, count:int) -> bytes:
+        size = count * self.type.sizeof
+        if len(self._data) < size and self.addr:
+            self._data = mem.read(self.addr, size)
+        return self._data[:size]
+
+    def words(self, count:int) -> list[int]:
+        data = self._read(count)
+        size = self.type.sizeof
+        return [int.from_bytes(data[i:i + size], "little") for i in range(0, len(data), size)]
+
+    def values(self, count:int) -> list[gdb.Value]:
+        data = self._read(count)
+        size = self.type.sizeof
+        return [gdb.Value(data[i:i + size], self.type) for i in range(0, len(data), size)]
+
+_elf_files: dict[str, elf.ElfFile|None] = {}
+
+def _elf_file() -> elf.ElfFile|None:
+    path = file.micropython.filename
+    if path not in _elf_files:
+        try:
+            _elf_files[path] = elf.ElfFile(path)
+        except (OSError, ValueError) as e:
+            log.warning("Cannot read %s: %s", path, e)
+            _elf_files[path] = None
+    return _elf_files[path]
+
+def code_bytes(addr:int, snapshot:heap.HeapSnapshot|None=None) -> bytes:
+    """The bytecode blob at `addr`, fetched with one read.
+
+    Bytecode on the heap is read up to the end of its allocation, or taken
+    from `snapshot` if it is given. Frozen bytecode is read from the ELF
+    file, up to the end of its section.
+    """
+    area = snapshot.get_ptr_area(addr, aligned=False) if snapshot is not None else None
+    if area is not None:
+        kinds = area.atb_kinds
+        block = area.block_from_ptr(addr)
+        end = block + 1
+        limit = min(block + MAX_CODE_SIZE // heap.BYTES_PER_BLOCK, len(kinds))
+        while end < limit and kinds[end] == heap.ATB.TAIL:
+            end += 1
+        return area.pool[addr - area.pool_start:end * heap.BYTES_PER_BLOCK]
+    allocation = heap.allocation(addr, MAX_CODE_SIZE // heap.BYTES_PER_BLOCK)
+    if allocation is not None:
+        start, length = allocation
+        return mem.read(addr, start + length - addr)
+    f = _elf_file()
+    if f is not None:
+        data = f.read_address(addr, MAX_CODE_SIZE)
+        if data is not None:
+            return data
+    return mem.read(addr, FALLBACK_CODE_SIZE)
+
+def _is_fun_bc(addr:int, fun_bc_struct:gdb.Type, snapshot:heap.HeapSnapshot, f:elf.ElfFile, mpy_tool) -> bool:
+    """Whether the `mp_type_fun_bc` word at `addr` in ROM starts a real function object.
+
+    Its bytecode must be on the heap or in a read-only section, and begin
+    with a prelude that decodes within the bytes there.
+    """
+    try:
+        fun_bc = mem.value(addr, fun_bc_struct)
+        if not int(fun_bc["context"]):
+            return False
+        bytecode = int(fun_bc["bytecode"])
+    except gdb.error:
+        return False
+    if snapshot.get_ptr_area(bytecode, aligned=False) is None and f.read_address(bytecode, 1) is None:
+        return False
+    if mpy_tool is None:
+        return True
+    try:
+        code = code_bytes(bytecode, snapshot)
+        sig = mpy_tool.extract_prelude(code, 0)
+    except (IndexError, ValueError, gdb.error):
+        return False
+    return sig[2] <= sig[3] <= sig[4] < len(code)
+
+def find_functions(snapshot:heap.HeapSnapshot) -> list[int]:
+    """Addresses of every `mp_type_fun_bc` object: on the heap, then frozen in ROM.
+
+    Frozen modules normally get their function objects on the heap when they
+    are imported, so ROM only holds the few defined statically; each match
+    there is checked with `_is_fun_bc` before it is trusted.
+    """
+    fun_bc_type = int(mp.type.fun_bc)
+    found = []
+    for area in snapshot.areas:
+        found.extend(area.ptr_from_block(head) for head in area.heads_of_type(fun_bc_type))
+    f = _elf_file()
+    if f is not None:
+        fun_bc_struct = mp.obj.fun_bc_t.target()
+        mpy_tool = depver.mpytool()
+        candidates = f.find_word(fun_bc_type, heap.BYTES_PER_WORD)
+        rom = [addr for addr in candidates if _is_fun_bc(addr, fun_bc_struct, snapshot, f, mpy_tool)]
+        if len(rom) < len(candidates):
+            log.info("Ignored %d of %d ROM words matching mp_type_fun_bc", len(candidates) - len(rom), len(candidates))
+        found.extend(rom)
+    return found
+
+def decode_jobs(infos:list[FunctionInfo]) -> list[tuple[bytes,int]]:
+    """`(code, start)` for `decode_all`, each code cut at the next function's bytecode.
+
+    `code` runs to the end of its allocation or ELF section; the next known
+    function bounds it more tightly, so less is copied to the workers.
+    """
+    starts = sorted({info.bytecode for info in infos})
+    jobs = []
+    for info in infos:
+        k = bisect.bisect_right(starts, info.bytecode)
+        size = starts[k] - info.bytecode if k < len(starts) else len(info.code)
+        jobs.append((info.code[:max(size, info.end)], info.end))
+    return jobs
+
+def _python_executable() -> str|None:
+    """The Python interpreter for worker processes; inside gdb `sys.executable` may be gdb itself."""
+    if sys.executable and os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    return shutil.which(f"python{sys.version_info.major}.{sys.version_info.minor}") or shutil.which("python3")
+
+def decode_all(jobs:list[tuple[bytes,int]], workers:int|None=None) -> list[list[tuple[int,int,int,int,int]]]:
+    """`decode` each `(code, start)`, in a pool of `workers` processes if there are enough jobs.
+
+    The workers are spawned rather than forked, so they do not inherit gdb's
+    state or threads; they import only `bcdecode` and mpy-tool. Without a
+    Python interpreter to spawn, the jobs are decoded here, one by one.
+    """
+    mpy_tool = depver.mpytool()
+    executable = _python_executable() if workers != 1 and len(jobs) >= POOL_MIN_FUNCTIONS else None
+    if executable is not None:
+        try:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(executable)
+            with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=bcdecode.init_worker,
+                                                        initargs=(mpy_tool.__file__,)) as pool:
+                return list(pool.map(bcdecode.decode_job, jobs, chunksize=max(len(jobs) // (4 * (workers or 4)), 1)))
+        except (OSError, concurrent.futures.BrokenExecutor) as e:
+            log.warning("Process pool failed (%s), decoding in-process", e)
+    return [decode(code, start, mpy_tool) for code, start in jobs]
+
+def line_addresses(functions:list[FunctionInfo], source:str, line:int) -> set[int]:
+    """Target addresses of the first instruction of each bytecode range compiled from `source:line`.
+
+    `source` matches a function's source file exactly or as a path suffix.
+    """
+    addresses = set()
+    for info in functions:
+        if info.source is None or not (info.source == source or info.source.endswith("/" + source)):
+            continue
+        for start, _ in info.offsets_for_line(line):
+            addresses.add(info.bytecode + info.end + start)
+    return addresses
+
+
+class LineBreakpoint(gdb.Breakpoint):
+    """One breakpoint in the bytecode dispatch loop, serving every `mpy break FILE:LINE`.
+
+    `stop` only compares the instruction pointer with a precomputed address
+    set, so hits on other instructions resume at once.
+    """
+    def __init__(self, location:str):
+        super().__init__(location, internal=False)
+        self.lines: dict[tuple[str,int], set[int]] = {}
+        self.addresses: set[int] = set()
+        self._read_ip = None
+
+    def set_line(self, source:str, line:int, addresses:set[int]):
+        self.lines[(source, line)] = addresses
+        self._update()
+
+    def remove_line(self, source:str, line:int):
+        self.lines.pop((source, line), None)
+        self._update()
+
+    def _update(self):
+        self.addresses = set().union(*self.lines.values())
+        # With nothing to match, stopping on every opcode would only slow the target down.
+        self.enabled = bool(self.addresses)
+
+    def _choose_ip_reader(self, frame:gdb.Frame):
+        # Prefer the VM's local `ip`; code_state->ip is only updated at some instructions.
+        try:
+            ip = frame.read_var("ip")
+            if not ip.is_optimized_out:
+                int(ip)
+                return lambda frame: int(frame.read_var("ip"))
+        except (ValueError, gdb.error):
+            pass
+        log.info("Local ip is not available, reading code_state->ip")
+        return lambda frame: int(frame.read_var("code_state")["ip"])
+
+    def stop(self):
+        try:
+            frame = gdb.selected_frame()
+            if self._read_ip is None:
+                self._read_ip = self._choose_ip_reader(frame)
+            return self._read_ip(frame) in self.addresses
+        except (gdb.error, ValueError):
+            return False
+
+def _clear_elf_files(event=None):
+    for f in _elf_files.values():
+        if f is not None:
+            f.close()
+    _elf_files.clear()
+
+class FunctionCache:
+    """`FunctionInfo` of every function seen so far, keyed by bytecode address.
+
+    Functions in ROM stay cached until the objfile changes. A function on
+    the heap is re-checked once per stop and dropped when its allocation is
+    freed or no longer holds the same prelude.
+    """
+    def __init__(self):
+        self._functions: dict[int, FunctionInfo] = {}
+
+    def __len__(self):
+        return len(self._functions)
+
+    def clear(self, event=None):
+        self._functions.clear()
+
+    def _valid(self, info:FunctionInfo) -> bool:
+        if info.generation == mem.cache.generation or info.allocation is None:
+            return True
+        allocation = heap.allocation(info.bytecode)
+        if allocation is None or allocation[0] != info.allocation[0]:
+            return False
+        if mem.read(info.bytecode, len(info.prelude)) != info.prelude:
+            return False
+        info.generation = mem.cache.generation
+        return True
+
+    def get(self, fun_bc:gdb.Value, snapshot:heap.HeapSnapshot|None=None) -> FunctionInfo:
+        addr = int(fun_bc["bytecode"])
+        info = self._functions.get(addr)
+        if info is not None and not self._valid(info):
+            log.debug("Function at %#x was freed, decoding it again", addr)
+            info = None
+        if info is None:
+            info = self._functions[addr] = FunctionInfo(fun_bc, snapshot)
+        return info
+
+functions = FunctionCache()
+gdb.events.new_objfile.connect(functions.clear)
+gdb.events.clear_objfiles.connect(functions.clear)
+gdb.events.new_objfile.connect(_clear_elf_files)
+gdb.events.clear_objfiles.connect(_clear_elf_files)
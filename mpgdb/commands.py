@@ -11,7 +11,7 @@ class CommandPrefix(gdb.Command):
 command_prefix = CommandPrefix()
 
 
-if depver.GDB >= "17.0":
+if depver.GDB >= (17, 0):
     _ParameterPrefix = gdb.ParameterPrefix
 else:
     class _ParameterPrefix:  # Directly copied from GDB 17.0
@@ -1,9 +1,13 @@
 import logging
 log = logging.getLogger("mpgdb.depver")
 
-from distutils.version import StrictVersion
 from types import ModuleType
-import sys, os, importlib
+import sys, os, importlib, functools, re
+from . import startup
+
+def parse_version(version:str) -> tuple[int, ...]:
+    """`"16.2.90.20250101-git"` -> `(16, 2)`, comparable with tuples like `(17, 0)`."""
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:2])
 
 def check_gdb():
     try:
@@ -12,13 +16,13 @@ def check_gdb():
         log.error("Cannot import GDB!")
         return None
     
-    v = StrictVersion(gdb.VERSION)
+    v = parse_version(gdb.VERSION)
 
-    if v < "16.0":
-        log.error("GDB %s < 16.0, this will not work!", v)
+    if v < (16, 0):
+        log.error("GDB %s < 16.0, this will not work!", gdb.VERSION)
 
-    elif v < "17.0":
-        log.warning("GDB %s < 17.0, some features disabled.", v)
+    elif v < (17, 0):
+        log.warning("GDB %s < 17.0, some features disabled.", gdb.VERSION)
 
     return v
 
@@ -35,13 +39,17 @@ def import_mpytool() -> ModuleType:
         
         return importlib.import_module("mpy-tool")
 
-def check_mpytool():
+@functools.cache
+def mpytool() -> ModuleType|None:
+    """mpy-tool, imported on first use, or None if it cannot be found."""
     try:
-        mpytool = import_mpytool()
-        return True
+        with startup.timed("mpy-tool", deferred=True):
+            return import_mpytool()
     except ImportError:
-        log.error("Cannot import mpy-tool!")
-        return False
+        log.warning("Cannot import mpy-tool. Disassembly will be unavailable.")
+        return None
+
+def check_mpytool():
+    return mpytool() is not None
 
 GDB = check_gdb()
-MPY = check_mpytool()
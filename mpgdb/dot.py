@@ -0,0 +1,85 @@
+import logging
+log = logging.getLogger("mpgdb.dot")
+import contextlib, re, shutil, tempfile
+from typing import TextIO
+
+_ID = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|-?(\.[0-9]+|[0-9]+(\.[0-9]*)?)")
+
+def quote(value) -> str:
+    """Quote a DOT ID, unless it is a plain ID, a number, or already quoted/HTML."""
+    value = str(value)
+    if _ID.fullmatch(value) or value.startswith('"') or value.startswith("<"):
+        return value
+    return '"' + value.replace('"', '\\"') + '"'
+
+def endpoint(ref:str) -> str:
+    """Quote an edge endpoint of the form `node` or `node:port`."""
+    node, sep, port = ref.partition(":")
+    if sep:
+        return quote(node) + ":" + quote(port)
+    return quote(node)
+
+def _attrs(attrs:dict) -> str:
+    if not attrs:
+        return ""
+    return " [" + ", ".join(f"{key}={quote(value)}" for key, value in attrs.items()) + "]"
+
+
+class DotWriter:
+    """Write a DOT graph to a stream as it is produced.
+
+    Nodes go straight to the output, inside whichever subgraphs are open.
+    Edges are spooled to a temporary file and written at the top level on
+    `close`, so an edge never drags a not-yet-written node into a cluster.
+    """
+    def __init__(self, out:TextIO, name:str, graph_type:str="digraph", **attrs):
+        self._out = out
+        self._edges = tempfile.TemporaryFile("w+")
+        self._depth = 1
+        self.node_count = 0
+        self.edge_count = 0
+        out.write(f"{graph_type} {quote(name)} {{\n")
+        for key, value in attrs.items():
+            self._line(f"{key}={quote(value)};")
+        self._edge_op = "->" if graph_type == "digraph" else "--"
+
+    def _line(self, text:str):
+        self._out.write("\t" * self._depth + text + "\n")
+
+    def set_graph_defaults(self, **attrs):
+        self._line("graph" + _attrs(attrs) + ";")
+
+    def set_node_defaults(self, **attrs):
+        self._line("node" + _attrs(attrs) + ";")
+
+    def set_edge_defaults(self, **attrs):
+        self._line("edge" + _attrs(attrs) + ";")
+
+    def add_node(self, name:str, **attrs):
+        self.node_count += 1
+        self._line(quote(name) + _attrs(attrs) + ";")
+
+    def add_edge(self, src:str, dst:str, **attrs):
+        self.edge_count += 1
+        self._edges.write(f"\t{endpoint(src)} {self._edge_op} {endpoint(dst)}{_attrs(attrs)};\n")
+
+    @contextlib.contextmanager
+    def subgraph(self, name:str, cluster:bool=False, **attrs):
+        if cluster:
+            name = "cluster_" + name
+        self._line(f"subgraph {quote(name)} {{")
+        self._depth += 1
+        for key, value in attrs.items():
+            self._line(f"{key}={quote(value)};")
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            self._line("}")
+
+    def close(self):
+        self._edges.seek(0)
+        shutil.copyfileobj(self._edges, self._out)
+        self._edges.close()
+        self._out.write("}\n")
+        log.info("Wrote %d nodes and %d edges", self.node_count, self.edge_count)
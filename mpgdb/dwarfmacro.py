@@ -0,0 +1,244 @@
+import logging
+log = logging.getLogger("mpgdb.dwarfmacro")
+import re
+from typing import NamedTuple
+import gdb
+from . import elf, startup
+
+DW_MACRO_define = 0x01
+DW_MACRO_undef = 0x02
+DW_MACRO_start_file = 0x03
+DW_MACRO_end_file = 0x04
+DW_MACRO_define_strp = 0x05
+DW_MACRO_undef_strp = 0x06
+DW_MACRO_import = 0x07
+DW_MACRO_define_sup = 0x08
+DW_MACRO_undef_sup = 0x09
+DW_MACRO_import_sup = 0x0a
+DW_MACRO_define_strx = 0x0b
+DW_MACRO_undef_strx = 0x0c
+
+# Operand sizes of the forms an opcode_operands_table may use; -1 is a ULEB128.
+_FORM_SIZES = {
+    0x0b: 1, 0x05: 2, 0x06: 4, 0x07: 8,  # data1, data2, data4, data8
+    0x0f: -1, 0x0d: -1, 0x1a: -1,        # udata, sdata, strx
+    0x25: 1, 0x26: 2, 0x27: 3, 0x28: 4,  # strx1..strx4
+}
+_OFFSET_FORMS = (0x0e, 0x17, 0x1f)      # strp, sec_offset, line_strp
+
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+
+class Macro(NamedTuple):
+    params: tuple[str, ...]|None
+    body: str
+
+    @property
+    def arity(self) -> int|None:
+        """Number of parameters, or None for an object-like macro."""
+        return None if self.params is None else len(self.params)
+
+def _uleb(data:bytes, pos:int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+def _cstring(data:bytes, pos:int) -> tuple[str, int]:
+    end = data.index(b"\0", pos)
+    return data[pos:end].decode("utf-8", "replace"), end + 1
+
+def parse_define(text:str) -> tuple[str, Macro]:
+    """`"NAME(a, b) body"` -> `("NAME", Macro(("a", "b"), "body"))`."""
+    name = _IDENTIFIER.match(text).group()
+    rest = text[len(name):]
+    if rest.startswith("("):
+        params, _, body = rest[1:].partition(")")
+        params = tuple(param.strip() for param in params.split(",") if param.strip())
+        return name, Macro(params, body.strip())
+    return name, Macro(None, rest.strip())
+
+def parse_units(data:bytes, strings:bytes|None, endian:str="<") -> dict[int, list]:
+    """Parse every macro unit in a `.debug_macro` section.
+
+    Each unit, keyed by its offset, becomes a list of steps: dicts of the
+    macros it defines (None for an undef), and the offsets of units it imports.
+    """
+    units = {}
+    byteorder = "little" if endian == "<" else "big"
+    pos = 0
+    skipped = 0
+    while pos < len(data):
+        start = pos
+        version = int.from_bytes(data[pos:pos + 2], byteorder)
+        flags = data[pos + 2]
+        pos += 3
+        if version not in (4, 5):
+            log.warning("Unsupported .debug_macro version %d at %#x, ignoring the rest", version, start)
+            break
+        offset_size = 8 if flags & 1 else 4
+        if flags & 2:
+            pos += offset_size
+        opcode_forms = {}
+        if flags & 4:
+            count = data[pos]
+            pos += 1
+            for _ in range(count):
+                opcode = data[pos]
+                n, pos = _uleb(data, pos + 1)
+                opcode_forms[opcode] = data[pos:pos + n]
+                pos += n
+
+        steps = []
+        current = {}
+        while True:
+            opcode = data[pos]
+            pos += 1
+            if opcode == 0:
+                break
+            elif opcode in (DW_MACRO_define, DW_MACRO_undef):
+                _, pos = _uleb(data, pos)
+                text, pos = _cstring(data, pos)
+            elif opcode in (DW_MACRO_define_strp, DW_MACRO_undef_strp):
+                _, pos = _uleb(data, pos)
+                offset = int.from_bytes(data[pos:pos + offset_size], byteorder)
+                pos += offset_size
+                if strings is None:
+                    skipped += 1
+                    continue
+                text, _ = _cstring(strings, offset)
+            elif opcode == DW_MACRO_start_file:
+                _, pos = _uleb(data, pos)
+                _, pos = _uleb(data, pos)
+                continue
+            elif opcode == DW_MACRO_end_file:
+                continue
+            elif opcode == DW_MACRO_import:
+                steps.append(current)
+                current = {}
+                steps.append(int.from_bytes(data[pos:pos + offset_size], byteorder))
+                pos += offset_size
+                continue
+            elif opcode in (DW_MACRO_define_sup, DW_MACRO_undef_sup, DW_MACRO_define_strx, DW_MACRO_undef_strx):
+                # Need a supplementary file or .debug_str_offsets, which gcc does not emit here.
+                _, pos = _uleb(data, pos)
+                if opcode in (DW_MACRO_define_sup, DW_MACRO_undef_sup):
+                    pos += offset_size
+                else:
+                    _, pos = _uleb(data, pos)
+                skipped += 1
+                continue
+            elif opcode == DW_MACRO_import_sup:
+                pos += offset_size
+                skipped += 1
+                continue
+            elif opcode in opcode_forms:
+                for form in opcode_forms[opcode]:
+                    if form in _OFFSET_FORMS:
+                        pos += offset_size
+                    elif form == 0x08:  # string
+                        _, pos = _cstring(data, pos)
+                    elif _FORM_SIZES.get(form) == -1:
+                        _, pos = _uleb(data, pos)
+                    elif form in _FORM_SIZES:
+                        pos += _FORM_SIZES[form]
+                    else:
+                        raise ValueError(f"Unknown form {form:#x} for macro opcode {opcode:#x}")
+                continue
+            else:
+                raise ValueError(f"Unknown macro opcode {opcode:#x} at {pos - 1:#x}")
+
+            if opcode in (DW_MACRO_define, DW_MACRO_define_strp):
+                name, macro = parse_define(text)
+                current[name] = macro
+            else:
+                current[text.strip()] = None
+        steps.append(current)
+        units[start] = steps
+    if skipped:
+        log.info("Skipped %d macro entries in unsupported forms", skipped)
+    return units
+
+def build_table(units:dict[int, list]) -> dict[str, Macro]:
+    """Macros defined at the end of each translation unit; the first unit to define a name wins.
+
+    Imported units (e.g. gcc's shared groups for common headers) are
+    evaluated once and reused by every unit that imports them.
+    """
+    imported = {step for steps in units.values() for step in steps if isinstance(step, int)}
+    effects: dict[int, dict[str, Macro|None]] = {}
+
+    def effect(offset:int) -> dict[str, Macro|None]:
+        result = effects.get(offset)
+        if result is None:
+            effects[offset] = result = {}  # guards against import cycles
+            for step in units.get(offset, ()):
+                result.update(effect(step) if isinstance(step, int) else step)
+        return result
+
+    table = {}
+    for offset in units:
+        if offset in imported:
+            continue
+        state = {}
+        for step in units[offset]:
+            state.update(effect(step) if isinstance(step, int) else step)
+        table = {name: macro for name, macro in state.items() if macro is not None} | table
+    return table
+
+def expand(name:str, table:dict[str, Macro], limit:int=32) -> str|None:
+    """Expand an object-like macro through the other object-like macros it uses.
+
+    Function-like macros are left in place for gdb to expand.
+    """
+    macro = table.get(name)
+    if macro is None or macro.params is not None:
+        return None
+
+    def replace(match:re.Match, seen:frozenset, depth:int) -> str:
+        word = match.group()
+        inner = table.get(word)
+        if inner is None or inner.params is not None or word in seen or depth >= limit:
+            return word
+        return _IDENTIFIER.sub(lambda m: replace(m, seen | {word}, depth + 1), inner.body)
+
+    return _IDENTIFIER.sub(lambda m: replace(m, frozenset([name]), 1), macro.body)
+
+_tables: dict[str, dict[str, Macro]|None] = {}
+
+def table(objfile:gdb.Objfile) -> dict[str, Macro]|None:
+    """Every macro in `objfile`'s `.debug_macro`, or None if it has none."""
+    try:
+        return _tables[objfile.filename]
+    except KeyError:
+        pass
+    result = None
+    with startup.timed(".debug_macro", deferred=True):
+        try:
+            f = elf.ElfFile(objfile.filename)
+        except (OSError, ValueError) as e:
+            log.warning("Cannot read %s: %s", objfile.filename, e)
+        else:
+            try:
+                data = f.read(".debug_macro")
+                if data is not None:
+                    result = build_table(parse_units(data, f.read(".debug_str"), f.endian))
+            except (ValueError, IndexError) as e:
+                log.warning("Cannot parse .debug_macro of %s: %s", objfile.filename, e)
+            finally:
+                f.close()
+    if result is None:
+        log.info("No usable .debug_macro in %s, asking gdb for each macro", objfile.filename)
+    else:
+        log.info("Read %d macros from .debug_macro", len(result))
+    _tables[objfile.filename] = result
+    return result
+
+def _clear_tables(event=None):
+    _tables.clear()
+
+gdb.events.new_objfile.connect(_clear_tables)
+gdb.events.clear_objfiles.connect(_clear_tables)
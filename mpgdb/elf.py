@@ -0,0 +1,108 @@
+import logging
+log = logging.getLogger("mpgdb.elf")
+import mmap, struct, zlib
+from typing import NamedTuple
+
+SHT_NOBITS = 8
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHF_COMPRESSED = 0x800
+ELFCOMPRESS_ZLIB = 1
+
+class Section(NamedTuple):
+    name: str
+    type: int
+    flags: int
+    addr: int
+    offset: int
+    size: int
+
+class ElfFile:
+    """Section headers and contents of an ELF file, read directly rather than through gdb."""
+    path: str
+    is64: bool
+    endian: str
+    sections: dict[str, Section]
+
+    def __init__(self, path:str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._data
+        if data[:4] != b"\x7fELF":
+            raise ValueError(f"{path} is not an ELF file")
+        self.is64 = data[4] == 2
+        self.endian = "<" if data[5] == 1 else ">"
+        if self.is64:
+            shoff, = struct.unpack_from(self.endian + "Q", data, 0x28)
+            shentsize, shnum, shstrndx = struct.unpack_from(self.endian + "HHH", data, 0x3A)
+            header = struct.Struct(self.endian + "IIQQQQIIQQ")
+        else:
+            shoff, = struct.unpack_from(self.endian + "I", data, 0x20)
+            shentsize, shnum, shstrndx = struct.unpack_from(self.endian + "HHH", data, 0x2E)
+            header = struct.Struct(self.endian + "IIIIIIIIII")
+        headers = [header.unpack_from(data, shoff + i * shentsize) for i in range(shnum)]
+        names_offset = headers[shstrndx][4] if shstrndx < shnum else 0
+
+        self.sections = {}
+        for name_index, type, flags, addr, offset, size, *_ in headers:
+            end = data.find(b"\0", names_offset + name_index)
+            name = data[names_offset + name_index:end].decode("ascii", "replace")
+            self.sections[name] = Section(name, type, flags, addr, offset, size)
+
+    def close(self):
+        self._data.close()
+
+    def read(self, name:str) -> bytes|None:
+        """Contents of section `name`, decompressed if needed, or None if there is no such section."""
+        section = self.sections.get(name)
+        if section is None:
+            return None
+        data = self._data[section.offset:section.offset + section.size]
+        if section.flags & SHF_COMPRESSED:
+            if self.is64:
+                ch_type, _, ch_size, _ = struct.unpack_from(self.endian + "IIQQ", data)
+                data = data[24:]
+            else:
+                ch_type, ch_size, _ = struct.unpack_from(self.endian + "III", data)
+                data = data[12:]
+            if ch_type != ELFCOMPRESS_ZLIB:
+                raise ValueError(f"{name} uses unsupported compression {ch_type}")
+            data = zlib.decompress(data, bufsize=ch_size)
+        return data
+
+    def read_address(self, addr:int, limit:int) -> bytes|None:
+        """Up to `limit` bytes loaded at `addr`, stopping at the end of its section.
+
+        None unless a read-only section with file contents is loaded there;
+        writable sections may have changed on the target.
+        """
+        for section in self.sections.values():
+            if (section.flags & (SHF_ALLOC | SHF_WRITE | SHF_COMPRESSED) == SHF_ALLOC and section.type != SHT_NOBITS
+                    and section.addr <= addr < section.addr + section.size):
+                start = section.offset + addr - section.addr
+                end = section.offset + section.size
+                return self._data[start:min(end, start + limit)]
+        return None
+
+    def find_word(self, value:int, size:int) -> list[int]:
+        """Addresses of every `size`-aligned word equal to `value` in read-only loaded data sections.
+
+        Code is skipped: instructions match arbitrary words far too often.
+        """
+        pattern = value.to_bytes(size, "little" if self.endian == "<" else "big")
+        found = []
+        for section in self.sections.values():
+            if (section.flags & (SHF_ALLOC | SHF_WRITE | SHF_EXECINSTR | SHF_COMPRESSED) != SHF_ALLOC
+                    or section.type == SHT_NOBITS):
+                continue
+            start = section.offset
+            end = section.offset + section.size
+            pos = self._data.find(pattern, start, end)
+            while pos >= 0:
+                addr = section.addr + pos - start
+                if addr % size == 0:
+                    found.append(addr)
+                pos = self._data.find(pattern, pos + 1, end)
+        return found
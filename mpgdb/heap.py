@@ -0,0 +1,867 @@
+import logging
+log = logging.getLogger("mpgdb.heap")
+import enum, functools, re, bisect, array, sys, json, mmap, struct, zlib
+import gdb
+from . import mem, startup
+
+# numpy is only imported when a heap table is first decoded.
+np = startup.lazy_module("numpy")
+has_numpy = np is not None
+if not has_numpy:
+    log.warning("Cannot import numpy. Heap tables will be decoded in pure Python.")
+
+BYTES_PER_WORD = 4
+BYTES_PER_BLOCK = 4 * BYTES_PER_WORD
+WORDS_PER_BLOCK = BYTES_PER_BLOCK // BYTES_PER_WORD
+
+
+def all_heap_areas(mem_state):
+    heap_area = mem_state["area"]
+    while heap_area:
+        yield heap_area
+        try:
+            heap_area = heap_area["next"]
+        except gdb.error:
+            return
+
+
+class BlockTable:
+    def __init_subclass__(cls, blocks_per_byte:int=4, table_name:str="gc_alloc_table_start"):
+        cls.blocks_per_byte = blocks_per_byte
+        cls.bits_per_block = 8 // cls.blocks_per_byte
+        cls.block_mask = ~(-1 << cls.bits_per_block)
+        cls.table_name = table_name
+    @classmethod
+    def lookup(cls, area:"HeapArea", block:int):
+        index, shift = divmod(block, cls.blocks_per_byte)
+        shift *= cls.bits_per_block
+        mask = cls.block_mask
+        return area.tables[cls.table_name][index] >> shift & mask
+
+    @classmethod
+    @functools.cache
+    def _byte_lut(cls) -> list[bytes]:
+        return [
+            bytes(byte >> (i * cls.bits_per_block) & cls.block_mask for i in range(cls.blocks_per_byte))
+            for byte in range(256)
+        ]
+
+    @classmethod
+    def decode(cls, table:bytes):
+        """Decode a whole table into one kind value per block.
+
+        Returns a uint8 array when numpy is available, otherwise `bytes`.
+        Either way, indexing it gives the block's kind as an int.
+        """
+        if has_numpy:
+            packed = np.frombuffer(table, dtype=np.uint8)
+            shifts = np.arange(cls.blocks_per_byte, dtype=np.uint8) * cls.bits_per_block
+            return ((packed[:, None] >> shifts) & cls.block_mask).reshape(-1)
+        else:
+            return b"".join(map(cls._byte_lut().__getitem__, table))
+
+class ATB(BlockTable, enum.IntEnum, blocks_per_byte=4, table_name="gc_alloc_table_start"):
+    FREE = 0
+    HEAD = 1
+    TAIL = 2
+    MARK = 3
+
+class FTB(BlockTable, enum.IntEnum, blocks_per_byte=8, table_name="gc_finaliser_table_start"):
+    CLEAR = 0
+    SET = 1
+
+
+_RUN_PATTERN = re.compile(b"[%c%c]%c*" % (ATB.HEAD, ATB.MARK, ATB.TAIL))
+_RUN_OR_ORPHAN_PATTERN = re.compile(b"[%c%c%c]%c*" % (ATB.HEAD, ATB.MARK, ATB.TAIL, ATB.TAIL))
+
+def find_runs(kinds, include_orphans:bool=False):
+    """Segment decoded ATB kinds into allocations.
+
+    Returns `(heads, lengths)`: the first block of every run of a head (or
+    mark) followed by its tails, and the run length in blocks. With
+    `include_orphans`, tails that do not follow a head also form runs.
+    """
+    if has_numpy and isinstance(kinds, np.ndarray):
+        n = len(kinds)
+        is_tail = kinds == ATB.TAIL
+        starts = (kinds == ATB.HEAD) | (kinds == ATB.MARK)
+        if include_orphans:
+            prev_free = np.empty(n, dtype=bool)
+            prev_free[:1] = True
+            prev_free[1:] = kinds[:-1] == ATB.FREE
+            starts |= is_tail & prev_free
+        heads = np.flatnonzero(starts)
+        boundaries = np.flatnonzero(~is_tail)
+        next_boundary = np.searchsorted(boundaries, heads, side="right")
+        ends = np.append(boundaries, n)[next_boundary]
+        return heads, ends - heads
+    else:
+        pattern = _RUN_OR_ORPHAN_PATTERN if include_orphans else _RUN_PATTERN
+        heads = []
+        lengths = []
+        for m in pattern.finditer(bytes(kinds)):
+            heads.append(m.start())
+            lengths.append(m.end() - m.start())
+        return heads, lengths
+
+
+_FREE_PATTERN = re.compile(b"%c+" % ATB.FREE)
+
+def find_free_runs(kinds):
+    """Lengths of every run of free blocks in decoded ATB kinds."""
+    if has_numpy and isinstance(kinds, np.ndarray):
+        free = np.concatenate(([False], kinds == ATB.FREE, [False]))
+        edges = np.flatnonzero(free[1:] != free[:-1])
+        return edges[1::2] - edges[::2]
+    else:
+        return [m.end() - m.start() for m in _FREE_PATTERN.finditer(bytes(kinds))]
+
+
+def _read(addr:int, length:int) -> bytes:
+    return mem.read(addr, length)
+
+def _read_qstrs(last_pool:gdb.Value) -> list[str]:
+    pools = []
+    pool = last_pool
+    while pool:
+        pools.append(pool)
+        pool = pool["prev"]
+    qstrs = []
+    for pool in reversed(pools):
+        for i in range(int(pool["len"])):
+            qstrs.append(pool["qstrs"][i].string())
+    return qstrs
+
+class HeapArea:
+    """Local copy of one gc heap area.
+
+    The pool, alloc table and finaliser table are each pulled from the target
+    with a single read, so walking the area afterwards costs no round trips.
+    """
+    num: int
+    pool_start: int
+    pool_end: int
+    block_count: int
+    pool: bytes
+    tables: dict[str, bytes]
+
+    def __init__(self, num:int, pool_start:int, pool_end:int, block_count:int, pool:bytes, atb:bytes, ftb:bytes):
+        self.num = num
+        self.pool_start = pool_start
+        self.pool_end = pool_end
+        self.block_count = block_count
+        self.pool = pool
+        self.tables = {ATB.table_name: atb, FTB.table_name: ftb}
+
+    @classmethod
+    def read(cls, num:int, area:gdb.Value) -> "HeapArea":
+        pool_start = int(area["gc_pool_start"])
+        pool_end = int(area["gc_pool_end"])
+
+        atb_len = int(area["gc_alloc_table_byte_len"])
+        block_count = atb_len * ATB.blocks_per_byte
+
+        atb = _read(int(area[ATB.table_name]), atb_len)
+        ftb_len = (block_count + FTB.blocks_per_byte - 1) // FTB.blocks_per_byte
+        try:
+            ftb_start = int(area[FTB.table_name])
+        except gdb.error:
+            log.warning("MICROPY_ENABLE_FINALISER is disabled, assuming no finalisers")
+            ftb = bytes(ftb_len)
+        else:
+            ftb = _read(ftb_start, ftb_len)
+
+        pool = _read(pool_start, pool_end - pool_start)
+        return cls(num, pool_start, pool_end, block_count, pool, atb, ftb)
+
+    @functools.cached_property
+    def atb_kinds(self):
+        return ATB.decode(self.tables[ATB.table_name])[:self.block_count]
+
+    @functools.cached_property
+    def ftb_kinds(self):
+        return FTB.decode(self.tables[FTB.table_name])[:self.block_count]
+
+    @functools.cached_property
+    def head_index(self):
+        """Owning head block for every block, built once from the alloc table.
+
+        Heads and marks map to themselves, tails to the head of their run.
+        Free blocks and orphaned tails also map to themselves.
+        """
+        kinds = self.atb_kinds
+        if has_numpy and isinstance(kinds, np.ndarray):
+            blocks = np.arange(len(kinds), dtype=np.intp)
+            last = np.maximum.accumulate(np.where(kinds != ATB.TAIL, blocks, -1))
+            owner_free = kinds[np.maximum(last, 0)] == ATB.FREE
+            return np.where((last < 0) | owner_free, blocks, last)
+        else:
+            heads = array.array("q")
+            last = -1
+            for block, kind in enumerate(kinds):
+                if kind == ATB.TAIL:
+                    heads.append(block if last < 0 else last)
+                elif kind == ATB.FREE:
+                    last = -1
+                    heads.append(block)
+                else:
+                    last = block
+                    heads.append(block)
+            return heads
+
+    def runs(self, include_orphans:bool=False):
+        return find_runs(self.atb_kinds, include_orphans=include_orphans)
+
+    def __contains__(self, ptr:int) -> bool:
+        return self.pool_start <= ptr < self.pool_end
+
+    def block_from_ptr(self, ptr:int) -> int:
+        return (int(ptr) - self.pool_start) // BYTES_PER_BLOCK
+
+    def ptr_from_block(self, block:int) -> int:
+        return self.pool_start + block * BYTES_PER_BLOCK
+
+    def word(self, block:int, index:int) -> int:
+        offset = block * BYTES_PER_BLOCK + index * BYTES_PER_WORD
+        return int.from_bytes(self.pool[offset:offset + BYTES_PER_WORD], "little")
+
+    def block_bytes(self, block:int, count:int=1) -> bytes:
+        offset = block * BYTES_PER_BLOCK
+        return self.pool[offset:offset + count * BYTES_PER_BLOCK]
+
+    def previous_head(self, block:int) -> int:
+        return int(self.head_index[block])
+
+    def heads_of_type(self, objtype:int) -> list[int]:
+        """Head blocks of every allocation whose first word is `objtype`."""
+        heads, lengths = self.runs()
+        if has_numpy and isinstance(heads, np.ndarray):
+            return heads[_words(self.pool)[heads * WORDS_PER_BLOCK] == objtype].tolist()
+        return [head for head in heads if self.word(head, 0) == objtype]
+
+
+ALLOC_TABLE_BLOCKS_PER_LINE = 64
+_ALLOC_TABLE_CHARS = bytes.maketrans(bytes([ATB.FREE, ATB.HEAD, ATB.TAIL, ATB.MARK]), b".h=m")
+_NOT_FREE_CHAR = re.compile(rb"[^.]")
+
+def alloc_table_chars(area:HeapArea, type_letters:dict[int,str]) -> bytes:
+    """One character per block, as `gc_dump_alloc_table` prints them.
+
+    Free blocks are '.', tails '=', marked heads 'm' and other heads 'h',
+    unless their type word is in `type_letters`.
+    """
+    kinds = area.atb_kinds
+    if has_numpy and isinstance(kinds, np.ndarray):
+        chars = np.frombuffer(_ALLOC_TABLE_CHARS, dtype=np.uint8)[kinds]
+        heads = np.flatnonzero(kinds == ATB.HEAD)
+        objtypes = _words(area.pool)[heads * WORDS_PER_BLOCK]
+        for objtype, letter in type_letters.items():
+            chars[heads[objtypes == objtype]] = ord(letter)
+        return chars.tobytes()
+    else:
+        chars = bytearray(bytes(kinds).translate(_ALLOC_TABLE_CHARS))
+        head = chars.find(b"h")
+        while head >= 0:
+            letter = type_letters.get(area.word(head, 0))
+            if letter is not None:
+                chars[head] = ord(letter)
+            head = chars.find(b"h", head + 1)
+        return bytes(chars)
+
+def alloc_table_lines(area:HeapArea, type_letters:dict[int,str], start:int=0, end:int|None=None):
+    """Render blocks `start` to `end` of an area in `gc_dump_alloc_table` format.
+
+    Yields one line of `ALLOC_TABLE_BLOCKS_PER_LINE` blocks at a time, each
+    prefixed by its byte offset into the pool. Two or more consecutive free
+    lines are collapsed into a "(N lines all free)" line, as the target does.
+    """
+    per_line = ALLOC_TABLE_BLOCKS_PER_LINE
+    chars = alloc_table_chars(area, type_letters)
+    end = area.block_count if end is None else min(end, area.block_count)
+    block = max(start, 0) // per_line * per_line
+    while block < end:
+        used = _NOT_FREE_CHAR.search(chars, block, end)
+        free_end = used.start() if used else end
+        if free_end - block >= 2 * per_line:
+            yield f"       ({(free_end - block) // per_line} lines all free)"
+            block = free_end // per_line * per_line
+            if block >= end:
+                break
+        yield f"{block * BYTES_PER_BLOCK:08x}: " + chars[block:min(block + per_line, end)].decode()
+        block += per_line
+
+
+_WORD_TYPECODES = {4: "I", 8: "Q"}
+
+def _words(data:bytes):
+    """View a little-endian buffer as target words."""
+    if has_numpy:
+        return np.frombuffer(data, dtype=np.dtype(f"<u{BYTES_PER_WORD}"), count=len(data) // BYTES_PER_WORD)
+    words = array.array(_WORD_TYPECODES[BYTES_PER_WORD])
+    words.frombytes(data[:len(data) - len(data) % BYTES_PER_WORD])
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words
+
+
+def _unmap(mapped:mmap.mmap):
+    try:
+        mapped.close()
+    except BufferError:
+        # Some slice of it is still referenced; the mapping goes when that is collected.
+        log.debug("Heap snapshot file still in use, unmapping it later")
+
+
+class HeapSnapshot:
+    """Local copy of every gc heap area, plus the roots needed to walk them.
+
+    A snapshot is either captured from the selected inferior, or loaded from
+    a file written by `save`, in which case no target is needed at all.
+    """
+    areas: list[HeapArea]
+    state: gdb.Value
+    state_address: int
+    registers: dict[str, int]
+    stack_bottom: int
+    stack: bytes
+    frames: list[tuple[int, int]]
+    qstrs: list[str]
+    live: bool
+    # The file a loaded snapshot's sections are views of.
+    _mapped: mmap.mmap|None = None
+
+    def __init__(self, areas:list[HeapArea], state:gdb.Value, state_address:int, registers:dict[str,int],
+                 stack_bottom:int, stack:bytes, frames:list[tuple[int,int]], qstrs:list[str], live:bool=True):
+        self.areas = areas
+        self.state = state
+        self.state_address = state_address
+        self.registers = registers
+        self.stack_bottom = stack_bottom
+        self.stack = stack
+        self.frames = frames
+        self.qstrs = qstrs
+        self.live = live
+        self._index_areas()
+
+    @property
+    def mem_state(self) -> gdb.Value:
+        return self.state["mem"]
+
+    @property
+    def stack_top(self) -> int:
+        return self.stack_bottom + len(self.stack)
+
+    def qstr(self, qstr:int) -> str|None:
+        if 0 <= qstr < len(self.qstrs):
+            return self.qstrs[qstr]
+        return None
+
+    @classmethod
+    def capture(cls, frame:gdb.Frame|None=None, include_qstrs:bool=False) -> "HeapSnapshot":
+        inferior = gdb.selected_inferior()
+        if frame is None:
+            frame = gdb.selected_frame()
+
+        symbol = gdb.lookup_symbol("mp_state_ctx")[0]
+        state_address = int(symbol.value().address)
+        state = gdb.Value(_read(state_address, symbol.type.sizeof), symbol.type)
+
+        areas = [HeapArea.read(num, area) for num, area in enumerate(all_heap_areas(state["mem"]))]
+
+        registers = {}
+        for reg in inferior.architecture().registers("general"):
+            registers[reg.name] = int(gdb.newest_frame().read_register(reg))
+
+        stack_top = int(state["thread"]["stack_top"])
+        stack_bottom = int(frame.read_register("sp"))
+        stack_bottom -= stack_bottom % BYTES_PER_WORD
+        stack = _read(stack_bottom, stack_top - stack_bottom)
+
+        frames = []
+        while frame is not None:
+            frames.append((frame.level(), int(frame.read_register("sp"))))
+            frame = frame.older()
+
+        qstrs = _read_qstrs(state["vm"]["last_pool"]) if include_qstrs else []
+
+        log.info("Captured %d heap area(s), %d blocks", len(areas), sum(a.block_count for a in areas))
+        return cls(areas, state, state_address, registers, stack_bottom, stack, frames, qstrs)
+
+    def close(self):
+        """Unmap the file of a loaded snapshot; the snapshot is empty afterwards."""
+        mapped, self._mapped = self._mapped, None
+        if mapped is None:
+            return
+        self.areas = []
+        self.stack = b""
+        self._index_areas()
+        _unmap(mapped)
+
+    def _index_areas(self):
+        self._sorted_areas = sorted(self.areas, key=lambda area: area.pool_start)
+        self._starts = [area.pool_start for area in self._sorted_areas]
+        self._ends = [area.pool_end for area in self._sorted_areas]
+        self._pool_ptrs = {}
+
+    def get_ptr_area(self, ptr, aligned=True) -> HeapArea|None:
+        ptr = int(ptr)
+        if aligned:
+            if ptr & (BYTES_PER_BLOCK - 1) != 0:
+                return None # must be aligned on a block
+        i = bisect.bisect_right(self._starts, ptr) - 1
+        if i >= 0 and ptr < self._ends[i]:
+            return self._sorted_areas[i]
+        else:
+            return None
+
+    def scan(self, data:bytes, aligned=True):
+        """Conservatively classify every word of `data` as a heap pointer.
+
+        Returns `(word_indices, area_nums, blocks, values)` for the words that
+        point into a heap area, in ascending word order.
+        """
+        words = _words(data)
+        if has_numpy:
+            starts = np.array(self._starts, dtype=words.dtype)
+            ends = np.array(self._ends, dtype=words.dtype)
+            nums = np.array([area.num for area in self._sorted_areas], dtype=np.intp)
+            candidate = np.searchsorted(starts, words, side="right") - 1
+            valid = candidate >= 0
+            candidate = np.where(valid, candidate, 0)
+            valid &= words < ends[candidate]
+            if aligned:
+                valid &= (words & (BYTES_PER_BLOCK - 1)) == 0
+            word_indices = np.flatnonzero(valid)
+            values = words[word_indices]
+            owner = candidate[word_indices]
+            blocks = (values - starts[owner]) // BYTES_PER_BLOCK
+            return word_indices, nums[owner], blocks.astype(np.intp), values
+        else:
+            word_indices, area_nums, blocks, values = [], [], [], []
+            for index, value in enumerate(words):
+                area = self.get_ptr_area(value, aligned=aligned)
+                if area is not None:
+                    word_indices.append(index)
+                    area_nums.append(area.num)
+                    blocks.append((value - area.pool_start) // BYTES_PER_BLOCK)
+                    values.append(value)
+            return word_indices, area_nums, blocks, values
+
+    def pool_pointers(self, area:HeapArea):
+        """Pointer scan of a whole pool, computed once per snapshot."""
+        try:
+            return self._pool_ptrs[area.num]
+        except KeyError:
+            result = self._pool_ptrs[area.num] = self.scan(area.pool)
+            return result
+
+    def enumerate_ptrs_in_blocks(self, area:HeapArea, block:int, count:int=1):
+        word_indices, area_nums, blocks, values = self.pool_pointers(area)
+        first = block * WORDS_PER_BLOCK
+        end = first + count * WORDS_PER_BLOCK
+        if has_numpy:
+            lo, hi = (int(j) for j in word_indices.searchsorted([first, end]))
+            word_indices = word_indices[lo:hi].tolist()
+            values = values[lo:hi].tolist()
+            lo, hi = 0, len(word_indices)
+        else:
+            lo = bisect.bisect_left(word_indices, first)
+            hi = bisect.bisect_left(word_indices, end)
+        for j in range(lo, hi):
+            i = word_indices[j] - first
+            yield (i, area.pool_start + word_indices[j] * BYTES_PER_WORD, int(values[j]))
+
+    def enumerate_ptrs_in_block(self, area:HeapArea, block:int):
+        return self.enumerate_ptrs_in_blocks(area, block)
+
+    def save(self, path:str):
+        """Write the snapshot to `path` in the format read back by `load`."""
+        sections = []
+        offset = 0
+        def add_section(data) -> list[int]:
+            nonlocal offset
+            start = offset
+            sections.append(data)
+            offset += len(data)
+            padding = -offset % SNAPSHOT_ALIGN
+            sections.append(bytes(padding))
+            offset += padding
+            return [start, len(data)]
+
+        header = {
+            "word_size": BYTES_PER_WORD,
+            "areas": [
+                {
+                    "num": area.num,
+                    "pool_start": area.pool_start,
+                    "pool_end": area.pool_end,
+                    "block_count": area.block_count,
+                    "pool": add_section(area.pool),
+                    "atb": add_section(area.tables[ATB.table_name]),
+                    "ftb": add_section(area.tables[FTB.table_name]),
+                }
+                for area in self.areas
+            ],
+            "state": {
+                "type": str(self.state.type),
+                "address": self.state_address,
+                "data": add_section(bytes(self.state.bytes)),
+            },
+            "registers": self.registers,
+            "stack": {
+                "bottom": self.stack_bottom,
+                "data": add_section(self.stack),
+            },
+            "frames": self.frames,
+            "qstrs": add_section("\0".join(self.qstrs).encode()),
+        }
+        header = json.dumps(header, separators=(",", ":")).encode()
+        prefix = _SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header))
+        data_start = len(prefix) + len(header)
+        data_start += -data_start % SNAPSHOT_ALIGN
+
+        with open(path, "wb") as f:
+            f.write(prefix)
+            f.write(header)
+            f.write(bytes(data_start - len(prefix) - len(header)))
+            for section in sections:
+                f.write(section)
+        log.info("Saved heap snapshot to %s (%d bytes)", path, data_start + offset)
+
+    @classmethod
+    def load(cls, path:str) -> "HeapSnapshot":
+        """Map a snapshot file written by `save`; sections are not copied."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            snapshot = cls._from_mapping(path, mapped)
+        except Exception:
+            _unmap(mapped)
+            raise
+        snapshot._mapped = mapped
+        log.info("Loaded heap snapshot from %s", path)
+        return snapshot
+
+    @classmethod
+    def _from_mapping(cls, path:str, mapped:mmap.mmap) -> "HeapSnapshot":
+        view = memoryview(mapped)
+        magic, version, header_len = _SNAPSHOT_PREFIX.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a heap snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is snapshot version {version}, expected {SNAPSHOT_VERSION}")
+        header_start = _SNAPSHOT_PREFIX.size
+        header = json.loads(bytes(view[header_start:header_start + header_len]))
+        if header["word_size"] != BYTES_PER_WORD:
+            raise ValueError(f"{path} has {header['word_size']}-byte words, expected {BYTES_PER_WORD}")
+        data_start = header_start + header_len
+        data_start += -data_start % SNAPSHOT_ALIGN
+
+        def section(span):
+            start, length = span
+            return view[data_start + start:data_start + start + length]
+
+        areas = [
+            HeapArea(
+                entry["num"], entry["pool_start"], entry["pool_end"], entry["block_count"],
+                section(entry["pool"]), section(entry["atb"]), section(entry["ftb"]),
+            )
+            for entry in header["areas"]
+        ]
+        state = gdb.Value(bytes(section(header["state"]["data"])), gdb.lookup_type(header["state"]["type"]))
+        qstrs = bytes(section(header["qstrs"])).decode()
+        qstrs = qstrs.split("\0") if qstrs else []
+
+        return cls(
+            areas, state, header["state"]["address"], header["registers"],
+            header["stack"]["bottom"], section(header["stack"]["data"]),
+            [tuple(frame) for frame in header["frames"]], qstrs, live=False,
+        )
+
+
+class HeapFingerprint:
+    """Compact per-allocation summary of a snapshot, for diffing two stops.
+
+    Each allocation costs one address, block count, type word and CRC-32 of
+    its contents, stored in flat arrays so several generations stay cheap.
+    """
+    addresses: array.array
+    blocks: array.array
+    types: array.array
+    hashes: array.array
+
+    def __init__(self, snapshot:HeapSnapshot):
+        self.addresses = array.array("Q")
+        self.blocks = array.array("I")
+        self.types = array.array("Q")
+        self.hashes = array.array("I")
+        for area in snapshot.areas:
+            heads, lengths = area.runs()
+            for head, length in zip(heads, lengths):
+                head, length = int(head), int(length)
+                self.addresses.append(area.ptr_from_block(head))
+                self.blocks.append(length)
+                self.types.append(area.word(head, 0))
+                self.hashes.append(zlib.crc32(area.block_bytes(head, length)))
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def entries(self) -> dict[int, tuple[int,int,int]]:
+        return {
+            address: (blocks, objtype, crc)
+            for address, blocks, objtype, crc in zip(self.addresses, self.blocks, self.types, self.hashes)
+        }
+
+
+class HeapStats:
+    """Allocation statistics for a snapshot, computed host-side.
+
+    Covers what `gc_dump_info` reports (used/free blocks, 1- and 2-block
+    allocations, largest block and largest free run) plus per-type and
+    power-of-two size histograms, finaliser counts and a fragmentation index.
+    """
+    total_blocks: int
+    used_blocks: int
+    free_blocks: int
+    allocations: int
+    finalisers: int
+    one_block: int
+    two_block: int
+    max_block: int
+    max_free: int
+    sizes: dict[int, int]
+    types: dict[int, list[int]]
+
+    def __init__(self, snapshot:HeapSnapshot):
+        self.total_blocks = 0
+        self.used_blocks = 0
+        self.free_blocks = 0
+        self.allocations = 0
+        self.finalisers = 0
+        self.one_block = 0
+        self.two_block = 0
+        self.max_block = 0
+        self.max_free = 0
+        self.sizes = {}
+        self.types = {}
+        for area in snapshot.areas:
+            self._add_area(area)
+
+    def _add_area(self, area:HeapArea):
+        kinds = area.atb_kinds
+        heads, lengths = area.runs()
+        free_runs = find_free_runs(kinds)
+        free_blocks = int(sum(free_runs))
+        self.total_blocks += area.block_count
+        self.free_blocks += free_blocks
+        self.used_blocks += area.block_count - free_blocks
+        self.allocations += len(heads)
+        self.max_free = max(self.max_free, int(max(free_runs, default=0)))
+        self.max_block = max(self.max_block, int(max(lengths, default=0)))
+
+        if has_numpy and isinstance(kinds, np.ndarray):
+            heads = np.asarray(heads, dtype=np.intp)
+            lengths = np.asarray(lengths, dtype=np.intp)
+            self.finalisers += int(np.count_nonzero(area.ftb_kinds[heads]))
+            self.one_block += int(np.count_nonzero(lengths == 1))
+            self.two_block += int(np.count_nonzero(lengths == 2))
+            objtypes = _words(area.pool)[heads * WORDS_PER_BLOCK]
+            unique, inverse, counts = np.unique(objtypes, return_inverse=True, return_counts=True)
+            blocks = np.bincount(inverse, weights=lengths, minlength=len(unique))
+            for objtype, count, block_sum in zip(unique.tolist(), counts.tolist(), blocks.tolist()):
+                self._add_type(objtype, count, int(block_sum))
+            buckets = np.frexp(lengths)[1]
+            for bucket, count in zip(*np.unique(buckets, return_counts=True)):
+                self._add_size(1 << (int(bucket) - 1), int(count))
+        else:
+            ftb_kinds = area.ftb_kinds
+            for head, length in zip(heads, lengths):
+                self.finalisers += ftb_kinds[head]
+                self.one_block += int(length == 1)
+                self.two_block += int(length == 2)
+                self._add_type(area.word(head, 0), 1, length)
+                self._add_size(1 << (length.bit_length() - 1), 1)
+
+    def _add_type(self, objtype:int, count:int, blocks:int):
+        totals = self.types.setdefault(objtype, [0, 0])
+        totals[0] += count
+        totals[1] += blocks
+
+    def _add_size(self, bucket:int, count:int):
+        self.sizes[bucket] = self.sizes.get(bucket, 0) + count
+
+    @property
+    def fragmentation(self) -> float:
+        """0 when all free blocks are one run, approaching 1 as they scatter."""
+        if not self.free_blocks:
+            return 0.0
+        return 1.0 - self.max_free / self.free_blocks
+
+
+class HeapChange(enum.Enum):
+    NEW = "new"
+    FREED = "freed"
+    GROWN = "grown"
+    SHRUNK = "shrunk"
+    CHANGED = "changed"
+
+def diff(old:HeapFingerprint, new:HeapFingerprint) -> list[tuple[HeapChange,int,int,int,int]]:
+    """Compare two fingerprints.
+
+    Returns `(change, address, old_blocks, new_blocks, type)` for every
+    allocation that differs. An allocation whose type word changed is
+    reported as freed and new, since the address was reused.
+    """
+    old_entries = old.entries()
+    new_entries = new.entries()
+    changes = []
+    for address, (blocks, objtype, crc) in new_entries.items():
+        previous = old_entries.get(address)
+        if previous is None or previous[1] != objtype:
+            if previous is not None:
+                changes.append((HeapChange.FREED, address, previous[0], 0, previous[1]))
+            changes.append((HeapChange.NEW, address, 0, blocks, objtype))
+        elif previous[0] < blocks:
+            changes.append((HeapChange.GROWN, address, previous[0], blocks, objtype))
+        elif previous[0] > blocks:
+            changes.append((HeapChange.SHRUNK, address, previous[0], blocks, objtype))
+        elif previous[2] != crc:
+            changes.append((HeapChange.CHANGED, address, blocks, blocks, objtype))
+    for address, (blocks, objtype, crc) in old_entries.items():
+        if address not in new_entries:
+            changes.append((HeapChange.FREED, address, blocks, 0, objtype))
+    changes.sort(key=lambda change: change[1])
+    return changes
+
+marks: dict[str, HeapFingerprint] = {}
+
+
+SNAPSHOT_MAGIC = b"MPYHEAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGN = 64
+_SNAPSHOT_PREFIX = struct.Struct("<8sII")
+
+loaded: HeapSnapshot|None = None
+
+def set_loaded(snapshot:HeapSnapshot|None):
+    """Make heap commands read `snapshot`, or the target if None, closing the snapshot it replaces."""
+    global loaded
+    if loaded is not None and loaded is not snapshot:
+        loaded.close()
+    loaded = snapshot
+
+def _close_loaded(event=None):
+    set_loaded(None)
+
+gdb.events.gdb_exiting.connect(_close_loaded)
+
+def current(**kwargs) -> HeapSnapshot:
+    """The loaded snapshot if there is one, otherwise a fresh capture."""
+    if loaded is not None:
+        return loaded
+    return HeapSnapshot.capture(**kwargs)
+
+
+class PrefetchParameter(gdb.Parameter):
+    """Configure how far heap objects are read ahead.
+    0 = off.
+    1 = read a whole allocation as soon as a pointer to it is decoded.
+    N = also read the allocations it points to, N-1 levels deep.
+    """
+    def __init__(self, name:str):
+        self.set_doc = "Configure how far heap objects are read ahead."
+        super().__init__(name, gdb.COMMAND_DATA, gdb.PARAM_ZUINTEGER)
+        self.value = 1
+        log.info("Registered parameter: %s", name)
+
+prefetch_depth = PrefetchParameter("mpy prefetch")
+
+PREFETCH_MAX_BLOCKS = 256
+
+_prefetch_bounds: tuple[int, list[tuple[int,int,int]]] = (-1, [])
+
+def _heap_area_bounds() -> list[tuple[int,int,int]]:
+    """`(pool_start, pool_end, alloc_table)` of every area, kept until the memory cache is flushed."""
+    global _prefetch_bounds
+    generation, bounds = _prefetch_bounds
+    if generation != mem.cache.generation:
+        mem_state = gdb.lookup_symbol("mp_state_ctx")[0].value()["mem"]
+        bounds = [
+            (int(area["gc_pool_start"]), int(area["gc_pool_end"]), int(area[ATB.table_name]))
+            for area in all_heap_areas(mem_state)
+        ]
+        _prefetch_bounds = (mem.cache.generation, bounds)
+    return bounds
+
+def _allocation(ptr:int, bounds:list[tuple[int,int,int]], max_blocks:int=PREFETCH_MAX_BLOCKS) -> tuple[int,int]|None:
+    """`(addr, length)` of the allocation containing `ptr`, from up to `max_blocks` of the alloc table around it."""
+    for pool_start, pool_end, atb_start in bounds:
+        if pool_start <= ptr < pool_end:
+            break
+    else:
+        return None
+    block = (ptr - pool_start) // BYTES_PER_BLOCK
+    lo = max(block - max_blocks, 0) // ATB.blocks_per_byte * ATB.blocks_per_byte
+    hi = min(block + max_blocks, (pool_end - pool_start) // BYTES_PER_BLOCK)
+    kinds = ATB.decode(mem.read(atb_start + lo // ATB.blocks_per_byte, -(-(hi - lo) // ATB.blocks_per_byte)))
+    i = block - lo
+    if kinds[i] == ATB.FREE:
+        return None
+    head = i
+    while head > 0 and kinds[head] == ATB.TAIL:
+        head -= 1
+    if kinds[head] not in (ATB.HEAD, ATB.MARK):
+        # A TAIL run reaching the start of the window: the head is out of reach.
+        return None
+    end = i + 1
+    while end < hi - lo and kinds[end] == ATB.TAIL:
+        end += 1
+    return pool_start + (lo + head) * BYTES_PER_BLOCK, (end - head) * BYTES_PER_BLOCK
+
+def allocation(ptr, max_blocks:int=PREFETCH_MAX_BLOCKS) -> tuple[int,int]|None:
+    """`(addr, length)` of the live heap allocation containing `ptr`, or None if it is free or not on the heap.
+
+    None too if its head is more than `max_blocks` before `ptr`; the length
+    is cut off `max_blocks` after `ptr`.
+    """
+    return _allocation(int(ptr), _heap_area_bounds(), max_blocks)
+
+def prefetch(ptr, depth:int|None=None):
+    """Read the heap allocation `ptr` points into ahead of use.
+
+    With a depth above 1, the allocations it points to are read too, one
+    level at a time, so a container and its items arrive in a few reads
+    instead of one per field. `depth` defaults to `set mpy prefetch`.
+    """
+    if depth is None:
+        depth = prefetch_depth.value
+    if not depth:
+        return
+    try:
+        bounds = _heap_area_bounds()
+        frontier = {int(ptr)}
+        seen = set()
+        for level in range(depth):
+            allocations = []
+            for p in frontier:
+                found = _allocation(p, bounds)
+                if found is not None and found[0] not in seen:
+                    seen.add(found[0])
+                    allocations.append(found)
+            if not allocations:
+                return
+            mem.cache.prefetch(allocations)
+            if level + 1 == depth:
+                return
+            frontier = set()
+            for addr, length in allocations:
+                data = mem.cache.peek(addr, length)
+                if data is None:
+                    continue
+                frontier.update(
+                    value for value in map(int, _words(data))
+                    if value % BYTES_PER_BLOCK == 0 and any(start <= value < end for start, end, _ in bounds)
+                )
+    except gdb.error as e:
+        log.debug("Prefetch of %#x failed: %s", int(ptr), e)
@@ -2,6 +2,9 @@ import gdb
 import logging
 from . import file
 from . import mp
+from . import mem
+from . import heap
+from . import printers
 
 log = logging.getLogger("mpgdb.map")
 
@@ -19,6 +22,8 @@ class MapPrinter(gdb.ValuePrinter):
     def children(self):
         try:
             obj = self.__value
+            if obj.address is not None:
+                obj = mem.value(int(obj.address), obj.type)
             # yield ("&", obj.address.cast(void.pointer()))
             yield ("all_keys_are_qstrs", obj['all_keys_are_qstrs'])
             yield ("is_fixed", obj['is_fixed'])
@@ -33,8 +38,7 @@ class MapPrinter(gdb.ValuePrinter):
     
     @classmethod
     def lookup(cls, value: gdb.Value):
-        if value.type == map_typedef:
-            return cls(value)
+        return cls(value)
 
 class MapTablePrinter(gdb.ValuePrinter):
     class EntriesParameter(gdb.Parameter):
@@ -58,12 +62,13 @@ class MapTablePrinter(gdb.ValuePrinter):
             
     entries = EntriesParameter("mpy map_entries")
 
-    def __init__(self, value: gdb.Value):
+    def __init__(self, value: gdb.Value, address: gdb.Value):
         self.__value = value
+        self.__address = address
     
     def to_string(self):
         try:
-            return self.__value.address.cast(void.pointer())
+            return self.__address.cast(void.pointer())
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
@@ -90,20 +95,27 @@ class MapTablePrinter(gdb.ValuePrinter):
     def lookup(cls, value: gdb.Value):
         try:
             if value.type.code == gdb.TYPE_CODE_PTR:
+                address = value
                 try:
                     value = value.dereference()
                 except gdb.error: # (void *) -> Attempt to dereference a generic pointer.
                     return
+            else:
+                address = value.address
             if value.type.code == gdb.TYPE_CODE_ARRAY:
                 elem = value.type.target().unqualified()
                 if elem == map_elem:
-                    return cls(value)
+                    if address is not None:
+                        heap.prefetch(address)
+                        value = mem.value(int(address), value.type)
+                    return cls(value, address)
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
 
-file.micropython.pretty_printers.append(MapPrinter.lookup)
+printers.register(map_typedef, MapPrinter.lookup)
 log.info("Registered pretty printer: %s", MapPrinter.__name__)
 
-file.micropython.pretty_printers.append(MapTablePrinter.lookup)
+printers.register(map_elem.vector(0), MapTablePrinter.lookup)
+printers.register(map_elem.vector(0).pointer(), MapTablePrinter.lookup)
 log.info("Registered pretty printer: %s", MapTablePrinter.__name__)
\ No newline at end of file
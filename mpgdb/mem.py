@@ -0,0 +1,174 @@
+import logging
+log = logging.getLogger("mpgdb.mem")
+import collections
+import gdb
+
+LINE_SIZE = 256
+MAX_LINES = 1024
+STRING_CHUNK = 64
+
+
+class PageCache:
+    """Line-granular cache of target memory, valid for one stop.
+
+    Reads are rounded out to whole `line_size` lines, and consecutive missing
+    lines are fetched with a single read. The cache is flushed whenever the
+    target may have changed its memory: on resume, on writes from gdb, after
+    inferior calls and when objfiles change.
+    """
+    line_size: int
+    max_lines: int
+    generation: int
+    hits: int
+    misses: int
+    reads: int
+    bytes_read: int
+    prefetched: int
+    flushes: int
+
+    def __init__(self, line_size:int=LINE_SIZE, max_lines:int=MAX_LINES):
+        self.line_size = line_size
+        self.max_lines = max_lines
+        self._lines: collections.OrderedDict[int, bytes] = collections.OrderedDict()
+        self.generation = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self.bytes_read = 0
+        self.prefetched = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def flush(self, event=None):
+        self.generation += 1
+        if self._lines:
+            self._lines.clear()
+            self.flushes += 1
+
+    def _fetch(self, first:int, count:int):
+        addr = first * self.line_size
+        data = bytes(gdb.selected_inferior().read_memory(addr, count * self.line_size))
+        self.reads += 1
+        self.bytes_read += len(data)
+        for i in range(count):
+            self._lines[first + i] = data[i * self.line_size:(i + 1) * self.line_size]
+
+    def _read_direct(self, addr:int, length:int) -> bytes:
+        self.reads += 1
+        self.bytes_read += length
+        return bytes(gdb.selected_inferior().read_memory(addr, length))
+
+    def _load(self, first:int, last:int) -> int:
+        """Fetch lines `first` to `last` that are not cached yet, returning how many were missing."""
+        missing = [line for line in range(first, last + 1) if line not in self._lines]
+        todo = missing
+        while todo:
+            start = todo[0]
+            count = 1
+            while count < len(todo) and todo[count] == start + count:
+                count += 1
+            self._fetch(start, count)
+            todo = todo[count:]
+        return len(missing)
+
+    def _evict(self):
+        while len(self._lines) > self.max_lines:
+            self._lines.popitem(last=False)
+
+    def read(self, addr:int, length:int) -> bytes:
+        if length <= 0:
+            return b""
+        first = addr // self.line_size
+        last = (addr + length - 1) // self.line_size
+        if last - first >= self.max_lines:
+            self.misses += last - first + 1
+            return self._read_direct(addr, length)
+
+        try:
+            missing = self._load(first, last)
+        except gdb.MemoryError:
+            # Part of a line is unreadable, only the exact range may be valid.
+            self.misses += last - first + 1
+            return self._read_direct(addr, length)
+        self.hits += last - first + 1 - missing
+        self.misses += missing
+
+        lines = self._lines
+        for line in range(first, last + 1):
+            lines.move_to_end(line)
+        data = b"".join(lines[line] for line in range(first, last + 1))
+        self._evict()
+        offset = addr - first * self.line_size
+        return data[offset:offset + length]
+
+    def peek(self, addr:int, length:int) -> bytes|None:
+        """Cached bytes at `addr`, or None; never reads the target or counts statistics."""
+        first = addr // self.line_size
+        last = (addr + length - 1) // self.line_size
+        try:
+            data = b"".join(self._lines[line] for line in range(first, last + 1))
+        except KeyError:
+            return None
+        offset = addr - first * self.line_size
+        return data[offset:offset + length]
+
+    def prefetch(self, ranges:list[tuple[int,int]]):
+        """Load `(addr, length)` ranges ahead of use, without counting hits or misses.
+
+        Ranges less than a line apart are merged, so neighbouring objects
+        cost one read between them. Unreadable ranges are skipped.
+        """
+        budget = self.max_lines // 2
+        merged = []
+        for addr, length in sorted(ranges):
+            first = addr // self.line_size
+            last = (addr + max(length, 1) - 1) // self.line_size
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        for first, last in merged:
+            if budget <= 0:
+                break
+            last = min(last, first + budget - 1)
+            budget -= last - first + 1
+            try:
+                self.prefetched += self._load(first, last)
+            except gdb.MemoryError:
+                continue
+        self._evict()
+
+cache = PageCache()
+
+def read(addr:int, length:int) -> bytes:
+    return cache.read(int(addr), length)
+
+def value(addr:int, type:gdb.Type) -> gdb.Value:
+    """A non-lvalue copy of the object at `addr`, read through the cache."""
+    return gdb.Value(read(addr, type.sizeof), type)
+
+def deref(ptr:gdb.Value) -> gdb.Value:
+    """Like `ptr.dereference()`, but read through the cache."""
+    return value(int(ptr), ptr.type.strip_typedefs().target())
+
+def string(ptr, limit:int=4096) -> str:
+    """Like `ptr.string()` for a NUL-terminated char pointer, read through the cache."""
+    addr = int(ptr)
+    data = b""
+    while len(data) < limit:
+        chunk = read(addr + len(data), STRING_CHUNK - (addr + len(data)) % STRING_CHUNK)
+        end = chunk.find(b"\0")
+        if end >= 0:
+            return (data + chunk[:end]).decode("utf-8", "replace")
+        data += chunk
+    return data[:limit].decode("utf-8", "replace")
+
+gdb.events.cont.connect(cache.flush)
+gdb.events.memory_changed.connect(cache.flush)
+gdb.events.inferior_call_post.connect(cache.flush)
+gdb.events.new_objfile.connect(cache.flush)
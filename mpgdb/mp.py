@@ -4,17 +4,37 @@ from typing import Callable, Generic, TypeVar, Iterable, Generator
 import abc
 T = TypeVar("T")
 from . import file
+from . import symcache
+from . import dwarfmacro
 import gdb
-import functools
+import functools, re
 
 # functools.partial(file.micropython.lookup_static_symbol, domain=gdb.SYMBOL_TYPE_DOMAIN)
 
 _MISSING = object()
+_NOT_FOUND = object()
+
+symbols = symcache.SymbolCache(file.micropython)
+gdb.events.before_prompt.connect(symbols.save)
+gdb.events.gdb_exiting.connect(symbols.save)
+
+class _NotFound(LookupError):
+    """Raised by `_lookup` when the name definitely does not resolve."""
 
 class _Lookup(abc.ABC, Generic[T]):
     @abc.abstractmethod
     def _lookup(self, name: str) -> T:
         raise NotImplementedError
+
+    # Section of the on-disk symbol cache, or None to only cache in memory.
+    _section: str|None = None
+
+    def _encode(self, name: str, value: T):
+        """JSON form of a resolved value for the disk cache, or None to not store it."""
+        return None
+
+    def _decode(self, name: str, stored) -> T:
+        raise NotImplementedError
     
     _cache: dict[str, T|None]
     _strict: bool
@@ -31,16 +51,41 @@ class _Lookup(abc.ABC, Generic[T]):
             if self._strict:
                 return default
         
+        if value is _NOT_FOUND:
+            return default
         if value is not _MISSING:
             return value
+
+        if self._section is not None:
+            stored = symbols.get(self._section, name)
+            if stored is None:
+                self._cache[name] = _NOT_FOUND
+                return default
+            if stored is not symcache._MISSING:
+                try:
+                    value = self._decode(name, stored)
+                except Exception as e:
+                    log.debug("Stale cached %s %s: %s", self._section, name, e)
+                else:
+                    self._cache[name] = value
+                    return value
         
         try:
             value = self._lookup(name)
+        except _NotFound:
+            self._cache[name] = _NOT_FOUND
+            if self._section is not None:
+                symbols.put(self._section, name, None)
+            return default
         except Exception:
-            del self._cache[name]
+            self._cache.pop(name, None)
             return default
         else:
             self._cache[name] = value
+            if self._section is not None:
+                stored = self._encode(name, value)
+                if stored is not None:
+                    symbols.put(self._section, name, stored)
             return value
 
     def __getattr__(self, name:str) -> T:
@@ -62,17 +107,45 @@ class _Lookup(abc.ABC, Generic[T]):
             return value
 
 
+    def names(self) -> list[str]:
+        """Every name this lookup was given or asked for, resolved or not."""
+        return list(self._cache)
+
     def __iter__(self) -> Generator[T,None,None]:
         for name in list(self._cache.keys()):
             if self._get(name, default=_MISSING) is not _MISSING:
                 yield name
 
+_types_by_name: dict[str, gdb.Type] = {}
+
+def _type_named(type_name: str) -> gdb.Type:
+    """The type spelled `type_name`, e.g. `const mp_obj_type_t *`, resolved once per name."""
+    t = _types_by_name.get(type_name)
+    if t is None:
+        t = _types_by_name[type_name] = gdb.parse_and_eval(f"({type_name})0").type
+    return t
+
 class _MpObjLookup(_Lookup[gdb.Type]):
+    """Lookup of `mp_obj_NAME_t` pointer types, cached on disk as type name and size."""
+    _section = "obj"
+
     def _lookup(self, name):
         fullname = "mp_obj_{}_t".format(name)
         symbol = file.micropython.lookup_static_symbol(fullname, gdb.SYMBOL_TYPE_DOMAIN)
+        if symbol is None:
+            raise _NotFound(fullname)
         return symbol.type.pointer()
 
+    def _encode(self, name, value):
+        return [str(value), value.target().sizeof]
+
+    def _decode(self, name, stored):
+        type_name, size = stored
+        t = _type_named(type_name)
+        if t.target().sizeof != size:
+            raise ValueError(f"{type_name} is {t.target().sizeof} bytes, cached as {size}")
+        return t
+
 obj = _MpObjLookup([
     # whole-codebase search for mp_obj_(.*)_t
     'module',
@@ -198,10 +271,23 @@ obj = _MpObjLookup([
     'checked_fun',
 ])
 
-class _MpTypeLookup(_Lookup[gdb.Value]):
+class _AddressLookup(_Lookup[gdb.Value]):
+    """Lookup of symbol addresses, cached on disk as address and pointer type."""
+    def _encode(self, name: str, value: gdb.Value):
+        return [int(value), str(value.type)]
+
+    def _decode(self, name: str, stored) -> gdb.Value:
+        address, type_name = stored
+        return gdb.Value(address).cast(_type_named(type_name))
+
+class _MpTypeLookup(_AddressLookup):
+    _section = "type"
+
     def _lookup(self, name):
         fullname = "mp_type_{}".format(name)
         symbol = file.micropython.lookup_global_symbol(fullname, gdb.SYMBOL_VAR_DOMAIN)
+        if symbol is None:
+            raise _NotFound(fullname)
         return symbol.value().address
 
 type = _MpTypeLookup([
@@ -373,11 +459,93 @@ type = _MpTypeLookup([
     "checked_fun",
 ])
 
+_TYPE_PREFIX = "mp_type_"
+_TYPE_SYMBOL = re.compile(r"\b" + _TYPE_PREFIX + r"(\w+)")
+_type_names: dict[str, dict[int, str]] = {}
+
+def _type_symbol_names() -> list[str]:
+    """Names, without the prefix, of every `mp_type_*` variable of type `mp_obj_type_t` with debug info."""
+    output = gdb.execute(f"info variables -q -t mp_obj_type_t ^{_TYPE_PREFIX}", False, True)
+    output = output.partition("Non-debugging symbols:")[0]
+    return _TYPE_SYMBOL.findall(output)
+
+def _find_type_objects(objfile:gdb.Objfile) -> Generator[tuple[int,str],None,None]:
+    """Every `mp_type_NAME` struct in `objfile`, port and module types included.
+
+    The names come from one `info variables` listing, plus the `type` and `obj`
+    tables; each is then resolved with symbol lookups, so static definitions
+    in several translation units each get an entry.
+    """
+    struct_code = gdb.TYPE_CODE_STRUCT
+    for name in dict.fromkeys(_type_symbol_names() + type.names() + obj.names()):
+        fullname = _TYPE_PREFIX + name
+        found = gdb.lookup_static_symbols(fullname, gdb.SYMBOL_VAR_DOMAIN)
+        global_symbol = gdb.lookup_global_symbol(fullname, gdb.SYMBOL_VAR_DOMAIN)
+        if global_symbol is not None:
+            found.append(global_symbol)
+        for symbol in found:
+            if symbol.symtab.objfile != objfile or symbol.type.strip_typedefs().code != struct_code:
+                continue
+            yield int(symbol.value().address), name
+
+def type_names(objfile:gdb.Objfile|None=None) -> dict[int, str]:
+    """Map of type object address to type name, built once per objfile.
+
+    Covers every `mp_obj_type_t` variable named `mp_type_*` with debug info, named
+    without its prefix, so classifying an object is one lookup on its type word.
+    """
+    if objfile is None:
+        objfile = file.micropython
+    names = _type_names.get(objfile.filename)
+    if names is None:
+        names = {}
+        try:
+            names.update(_find_type_objects(objfile))
+        except gdb.error as e:
+            log.warning("Cannot list type objects (%s), using known types only", e)
+        if objfile == file.micropython:
+            for name in type:
+                names.setdefault(int(type[name]), name)
+        log.info("Indexed %d types in %s", len(names), objfile.filename)
+        _type_names[objfile.filename] = names
+    return names
+
+_type_structs: dict[str, dict[int, gdb.Type]] = {}
+
+def type_structs(objfile:gdb.Objfile|None=None) -> dict[int, gdb.Type]:
+    """Map of type object address to the `mp_obj_*_t` pointer type of its instances.
+
+    Only types with a matching entry in `obj` appear, so an object can be
+    cast to its concrete struct with one lookup on its type word.
+    """
+    if objfile is None:
+        objfile = file.micropython
+    structs = _type_structs.get(objfile.filename)
+    if structs is None:
+        structs = {}
+        for address, name in type_names(objfile).items():
+            typedef = obj._get(name)
+            if typedef is not None:
+                structs[address] = typedef
+        _type_structs[objfile.filename] = structs
+    return structs
+
+def _clear_type_names(event):
+    _type_names.clear()
+    _type_structs.clear()
+    _types_by_name.clear()
+gdb.events.new_objfile.connect(_clear_type_names)
+gdb.events.clear_objfiles.connect(_clear_type_names)
+
+
+class _MpModuleLookup(_AddressLookup):
+    _section = "module"
 
-class _MpModuleLookup(_Lookup[gdb.Value]):
     def _lookup(self, name: str) -> T:
         fullname = "mp_module_{}".format(name)
         symbol = file.micropython.lookup_global_symbol(fullname, gdb.SYMBOL_VAR_DOMAIN)
+        if symbol is None:
+            raise _NotFound(fullname)
         return symbol.value().address
 
 module = _MpModuleLookup([
@@ -418,10 +586,14 @@ module = _MpModuleLookup([
     "zsensor",
 ])
 
-class _MpExtmodLookup(_Lookup[gdb.Value]):
+class _MpExtmodLookup(_AddressLookup):
+    _section = "extmod"
+
     def _lookup(self, name: str) -> T:
         fullname = "{}_module".format(name)
         symbol = file.micropython.lookup_global_symbol(fullname, gdb.SYMBOL_VAR_DOMAIN)
+        if symbol is None:
+            raise _NotFound(fullname)
         return symbol.value().address
 
 extmod = _MpExtmodLookup([
@@ -463,8 +635,25 @@ def _macro_eval_template(template, *args):
 
 
 class _MacroConstLookup(_Lookup[gdb.Value]):
+    _section = "macro"
+
     def _lookup(self, name):
+        table = dwarfmacro.table(file.micropython)
+        if table is not None and name not in table:
+            raise _NotFound(name)
         return _macro_eval(name)
+
+    def _encode(self, name, value):
+        table = dwarfmacro.table(file.micropython)
+        if table is not None:
+            return dwarfmacro.expand(name, table)
+        try:
+            return _macro_expand(name)
+        except gdb.error:
+            return None
+
+    def _decode(self, name, stored):
+        return _macro_eval(stored)
     # _lookup = _macro_eval
 
 macro = _MacroConstLookup(strict=True, names=[
@@ -1046,10 +1235,89 @@ class ReprParameter(gdb.Parameter):
             },
         }
         return all_fallbacks[self.value]
+
+    def _native_functions(self) -> dict[str, Callable[[int], int]]:
+        """The REPR's decoding macros as plain-int Python functions.
+
+        These mirror `_fallback_macro_templates`, but run without a round trip
+        through gdb's expression evaluator.
+        """
+        self._maybe_do_guess()
+        bits = 64 if self.value == self.REPR_D else 8 * _word_size()
+        mask = (1 << bits) - 1
+        sign = 1 << (bits - 1)
+        def signed(v):
+            v &= mask
+            return v - (v & sign) * 2
+
+        all_natives = {
+            self.REPR_A:{
+                "MP_OBJ_IS_SMALL_INT": lambda v: (v & 1) != 0,
+                "MP_OBJ_SMALL_INT_VALUE": lambda v: signed(v) >> 1,
+                "MP_OBJ_IS_QSTR": lambda v: (v & 7) == 2,
+                "MP_OBJ_QSTR_VALUE": lambda v: (v & mask) >> 3,
+                "MP_OBJ_IS_IMMEDIATE_OBJ": lambda v: (v & 7) == 6,
+                "MP_OBJ_IMMEDIATE_OBJ_VALUE": lambda v: (v & mask) >> 3,
+                "MP_OBJ_IS_OBJ": lambda v: (v & 3) == 0,
+            },
+            self.REPR_B:{
+                "MP_OBJ_IS_SMALL_INT": lambda v: (v & 3) == 1,
+                "MP_OBJ_SMALL_INT_VALUE": lambda v: signed(v) >> 2,
+                "MP_OBJ_IS_QSTR": lambda v: (v & 7) == 3,
+                "MP_OBJ_QSTR_VALUE": lambda v: (v & mask) >> 3,
+                "MP_OBJ_IS_IMMEDIATE_OBJ": lambda v: (v & 7) == 7,
+                "MP_OBJ_IMMEDIATE_OBJ_VALUE": lambda v: (v & mask) >> 3,
+                "MP_OBJ_IS_OBJ": lambda v: (v & 1) == 0,
+            },
+            self.REPR_C:{
+                "MP_OBJ_IS_SMALL_INT": lambda v: (v & 1) != 0,
+                "MP_OBJ_SMALL_INT_VALUE": lambda v: signed(v) >> 1,
+                "MP_OBJ_IS_QSTR": lambda v: (v & 0xff80000f) == 0x00000006,
+                "MP_OBJ_QSTR_VALUE": lambda v: (v & mask) >> 4,
+                "MP_OBJ_IS_IMMEDIATE_OBJ": lambda v: (v & 0xff80000f) == 0x0000000e,
+                "MP_OBJ_IMMEDIATE_OBJ_VALUE": lambda v: (v & mask) >> 4,
+                "MP_OBJ_IS_OBJ": lambda v: (v & 3) == 0,
+            },
+            self.REPR_D:{
+                "MP_OBJ_IS_SMALL_INT": lambda v: (v & 0xffff000000000000) == 0x0001000000000000,
+                "MP_OBJ_SMALL_INT_VALUE": lambda v: signed(v << 16) >> 17,
+                "MP_OBJ_IS_QSTR": lambda v: (v & 0xffff000000000000) == 0x0002000000000000,
+                "MP_OBJ_QSTR_VALUE": lambda v: ((v & 0xffffffff) >> 1) & 0xffffffff,
+                "MP_OBJ_IS_IMMEDIATE_OBJ": lambda v: (v & 0xffff000000000000) == 0x0003000000000000,
+                "MP_OBJ_IMMEDIATE_OBJ_VALUE": lambda v: ((v & 0xffffffff) >> 46) & 3,
+                "MP_OBJ_IS_OBJ": lambda v: (v & 0xffff000000000000) == 0x0000000000000000,
+            },
+        }
+        return all_natives[self.value]
+
+    def _native_samples(self) -> list[int]:
+        """Object words covering every tag of every REPR, to check native functions against gdb."""
+        bits = 64 if self.value == self.REPR_D else 8 * _word_size()
+        mask = (1 << bits) - 1
+        samples = [0, 1, 2, 3, 4, 5, 6, 7, 8, 0xe, 0xf, 0x16, 0x1e, 0x2a5, 0x20001230, 0x20001233, 0x7f80000e, 0xff80000e]
+        samples += [mask, mask - 1, mask >> 1, (mask >> 1) + 1, mask - 6]
+        if bits == 64:
+            samples += [tag << 48 | low for tag in range(4) for low in [0, 1, 0x2469, 0x7fffffffffff]]
+        return [sample & mask for sample in samples]
+
 obj_repr = ReprParameter("mpy repr")
 
+@functools.cache
+def _word_size() -> int:
+    return file.micropython.lookup_static_symbol("mp_int_t", gdb.SYMBOL_TYPE_DOMAIN).type.sizeof
+
 class _MacroFuncLookup(_Lookup[Callable]):
+    _section = "macro_fn"
+
     def _lookup(self, name: str) -> Callable:
+        table = dwarfmacro.table(file.micropython)
+        if table is not None:
+            macro = table.get(name)
+            if macro is None:
+                return self._make(name, 1, False, self._verify_native(name, False, {}))
+            # An object-like macro is called as `NAME(x)`, like `macro expand NAME(0)` would.
+            nargs = macro.arity if macro.arity is not None else 1
+            return self._make(name, nargs, True, self._verify_native(name, True, {}))
         try:
             # validate that the macro exists before we return the curried function
             original = name+"(0)"
@@ -1063,9 +1331,47 @@ class _MacroFuncLookup(_Lookup[Callable]):
             expanded = None
             nargs = int(msg.split(",")[0].split(" ")[-1])
 
+        # valid but nonexistent macro name if it expands to itself
+        defined = original != expanded
+        return self._make(name, nargs, defined, self._verify_native(name, defined, {}))
+
+    def _encode(self, name: str, value: Callable):
+        return [value.nargs, value.defined, value.native_ok]
+
+    def _decode(self, name: str, stored) -> Callable:
+        nargs, defined, *rest = stored
+        native_ok = dict(rest[0]) if rest else {}
+        known = len(native_ok)
+        self._verify_native(name, defined, native_ok)
+        if len(native_ok) != known:
+            symbols.put(self._section, name, [nargs, defined, native_ok])
+        return self._make(name, nargs, defined, native_ok)
+
+    def _verify_native(self, name: str, defined: bool, native_ok: dict[str, bool]) -> dict[str, bool]:
+        """`native_ok` with an entry for the current REPR, checking the native function once if it has none.
+
+        The results are kept in the `macro_fn` cache entry, so later sessions skip the check.
+        """
+        native = obj_repr._native_functions().get(name)
+        if native is None or obj_repr.value in native_ok:
+            return native_ok
+        fallback_template = obj_repr._fallback_macro_templates()[name]
+        native_ok[obj_repr.value] = self._check_native(name, native, defined, fallback_template)
+        return native_ok
+
+    def _make(self, name: str, nargs: int, defined: bool, native_ok: dict[str, bool]) -> Callable:
         fallback_template = obj_repr._fallback_macro_templates()[name]
+        native = obj_repr._native_functions().get(name)
+        if native is not None and native_ok.get(obj_repr.value):
+            def f(arg):
+                return native(int(arg))
+            f.__name__ = name
+            f.nargs = nargs
+            f.defined = defined
+            f.native_ok = native_ok
+            return f
 
-        if original == expanded: # valid but nonexistent macro name
+        if not defined:
             def f(*args):
                 return _macro_eval_template(fallback_template, *args)
             
@@ -1083,8 +1389,35 @@ class _MacroFuncLookup(_Lookup[Callable]):
                 return _macro_eval_template(fallback_template, *args)
                 
         f.__name__ = name
+        f.nargs = nargs
+        f.defined = defined
+        f.native_ok = native_ok
         return f
 
+    def _check_native(self, name: str, native: Callable[[int], int], defined: bool, fallback_template: str) -> bool:
+        """Compare a native function with gdb's evaluation of the macro on sample words."""
+        obj_t = file.micropython.lookup_static_symbol("mp_obj_t", gdb.SYMBOL_TYPE_DOMAIN).type
+        try:
+            for sample in obj_repr._native_samples():
+                arg = gdb.Value(sample).cast(obj_t)
+                if defined:
+                    try:
+                        expected = _macro_call(name, arg)
+                    except gdb.error as e:
+                        if not e.args[0].startswith("No symbol "):
+                            raise e
+                        expected = _macro_eval_template(fallback_template, arg)
+                else:
+                    expected = _macro_eval_template(fallback_template, arg)
+                if int(expected) != int(native(sample)):
+                    log.warning("Native %s(%#x) = %#x, gdb says %#x; evaluating it in gdb instead",
+                                name, sample, int(native(sample)), int(expected))
+                    return False
+        except gdb.error as e:
+            log.warning("Cannot check native %s (%s); evaluating it in gdb instead", name, e)
+            return False
+        return True
+
 macro_fn = _MacroFuncLookup(strict=True, names=[
     # from mpconfig.h
     "MICROPY_MAKE_VERSION",
@@ -4,6 +4,9 @@ import logging
 from . import file
 from . import mp
 from . import qstr
+from . import mem
+from . import heap
+from . import printers
 
 log = logging.getLogger("mpgdb.obj")
 
@@ -96,20 +99,21 @@ class ObjSmallIntPrinter(gdb.ValuePrinter):
             raise e
 
 class ObjObjPrinter(gdb.ValuePrinter):
-    def __init__(self, value: gdb.Value):
-        self.__value = value
+    def __init__(self, ptr: gdb.Value):
+        self.__ptr = ptr
 
     def to_string(self):
         try:
-            return self.__value.address.format_string(raw=True)
+            return self.__ptr.format_string(raw=True)
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
         
     def children(self):
         try:
-            for field in  self.__value.type.fields():
-                yield (field.name, self.__value[field])
+            value = mem.deref(self.__ptr)
+            for field in value.type.fields():
+                yield (field.name, value[field])
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
@@ -120,21 +124,14 @@ class ObjObjPrinter(gdb.ValuePrinter):
             decoded = decode_object_obj(value)
             if decoded is None:
                 return None
-                    
-            for type_name in mp.type:
-                type_obj = getattr(mp.type, type_name, None)
-                if type_obj is None:
-                    continue
-                if type_obj != decoded["base"]["type"]:
-                    continue
-                    
-                typedef = getattr(mp.obj, type_name, None)
-                if typedef is None:
-                    continue
 
+            heap.prefetch(decoded)
+            objtype = int(mem.value(int(decoded), mp.obj.base.target())["type"])
+            typedef = mp.type_structs().get(objtype)
+            if typedef is not None:
                 decoded = decoded.cast(typedef)
-                
-            return cls(decoded.dereference())
+
+            return cls(decoded)
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
@@ -178,20 +175,14 @@ class ObjBasePrinter(gdb.ValuePrinter):
 
     @classmethod
     def lookup(cls, value):
-        if value.type == mp.obj.base.target():
-            return cls(value)
-        else:
-            return None
+        return cls(value)
         
-file.micropython.pretty_printers.append(ObjConstPrinter.lookup)
-log.info("Registered pretty printer: %s", ObjConstPrinter.__name__)
-file.micropython.pretty_printers.append(ObjImmediatePrinter.lookup)
-log.info("Registered pretty printer: %s", ObjImmediatePrinter.__name__)
-file.micropython.pretty_printers.append(ObjSmallIntPrinter.lookup)
-log.info("Registered pretty printer: %s", ObjSmallIntPrinter.__name__)
-file.micropython.pretty_printers.append(ObjObjPrinter.lookup)
-log.info("Registered pretty printer: %s", ObjObjPrinter.__name__)
-file.micropython.pretty_printers.append(ObjBasePrinter.lookup)
+# mp_obj_t may also hold a qstr, which the qstr printer (registered by qstr) claims first.
+for printer in [ObjConstPrinter, ObjImmediatePrinter, ObjSmallIntPrinter, ObjObjPrinter]:
+    for t in [obj_t, const_obj_t, rom_obj_t]:
+        printers.register(t, printer.lookup)
+    log.info("Registered pretty printer: %s", printer.__name__)
+printers.register(mp.obj.base.target(), ObjBasePrinter.lookup)
 log.info("Registered pretty printer: %s", ObjBasePrinter.__name__)
 
 # TODO specific object printers:
@@ -0,0 +1,65 @@
+import logging
+log = logging.getLogger("mpgdb.printers")
+from typing import Callable
+import gdb
+from . import file, startup
+
+_AGGREGATES = (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION, gdb.TYPE_CODE_ENUM)
+_DERIVED = (gdb.TYPE_CODE_PTR, gdb.TYPE_CODE_ARRAY)
+
+_printers: dict[object, list[Callable]] = {}
+_deferred: list[str] = []
+
+def type_key(t:gdb.Type):
+    """Dictionary key for a type: its typedef name, or its tag for structs.
+
+    Typedefs of structs, unions and enums key on the tag, so a value typed
+    either way finds the same printers. Pointers and arrays key on what they
+    point to, e.g. `(TYPE_CODE_PTR, "_mp_map_t")`.
+    """
+    t = t.unqualified()
+    if t.code == gdb.TYPE_CODE_TYPEDEF:
+        target = t.strip_typedefs()
+        if target.code not in _AGGREGATES:
+            return t.name
+        t = target.unqualified()
+    if t.code in _DERIVED:
+        return (t.code, type_key(t.target()))
+    return t.name
+
+def register(t:gdb.Type, lookup:Callable[[gdb.Value], object], first:bool=False):
+    """Try `lookup` for values of type `t`, after printers registered earlier for it, or before them if `first`."""
+    lookups = _printers.setdefault(type_key(t), [])
+    if lookup not in lookups:
+        if first:
+            lookups.insert(0, lookup)
+        else:
+            lookups.append(lookup)
+
+def defer(module:str):
+    """Import `module`, which registers printers, just before the first lookup."""
+    _deferred.append(module)
+
+def _load_deferred():
+    while _deferred:
+        module = _deferred.pop(0)
+        try:
+            startup.load(module)
+        except Exception as e:
+            log.exception("Cannot load printers from %s: %r", module, e)
+
+def lookup(value:gdb.Value):
+    """The single pretty-printer lookup; one dictionary probe for non-MicroPython types."""
+    if _deferred:
+        _load_deferred()
+    lookups = _printers.get(type_key(value.type))
+    if lookups is None:
+        return None
+    for printer_lookup in lookups:
+        printer = printer_lookup(value)
+        if printer is not None:
+            return printer
+    return None
+
+file.micropython.pretty_printers.append(lookup)
+log.info("Registered pretty printer dispatcher")
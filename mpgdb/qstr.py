@@ -1,33 +1,193 @@
 import gdb
 import logging
+import bisect, collections, functools
+from typing import NamedTuple
 from . import file
-from . import obj
 from . import mp
+from . import mem
+from . import heap
+from . import printers
 
 log = logging.getLogger("mpgdb.qstr")
 
 qstr_t = file.micropython.lookup_static_symbol("qstr", gdb.SYMBOL_TYPE_DOMAIN).type
 qstr_short_t = file.micropython.lookup_static_symbol("qstr_short_t", gdb.SYMBOL_TYPE_DOMAIN).type
+pool_t = file.micropython.lookup_static_symbol("qstr_pool_t", gdb.SYMBOL_TYPE_DOMAIN).type
+pool_qstrs = pool_t.strip_typedefs()["qstrs"]
+# mp_obj_t and friends, which may hold a qstr; looked up here rather than taken
+# from obj so that either module can be imported first.
+obj_types = [
+    file.micropython.lookup_static_symbol(name, gdb.SYMBOL_TYPE_DOMAIN).type
+    for name in ("mp_obj_t", "mp_const_obj_t", "mp_rom_obj_t")
+]
 
 saved = None
 
 def decode_qstr(o: gdb.Value) -> int|None:
-    if obj.is_obj(o) and mp.macro_fn.MP_OBJ_IS_QSTR(o):
+    if o.type.name in [t.name for t in obj_types] and mp.macro_fn.MP_OBJ_IS_QSTR(o):
         return mp.macro_fn.MP_OBJ_QSTR_VALUE(o)
     elif o.type.name in [qstr_t.name, qstr_short_t.name]:
         return o
 
+class PoolIndex:
+    """Flattened index of the qstr pool chain, refreshed once per stop.
+
+    Pools are kept oldest first as `(total_prev_len, len, qstrs address, pool
+    address)`, so a qstr is found by bisecting on `total_prev_len`. Pools
+    outside the gc heap are static: they and their strings are read once.
+    Pools on the heap can be freed by a soft reset and reallocated at the same
+    address with other strings, so they are walked again from `last_pool`, and
+    their strings dropped, whenever the memory cache is flushed.
+    """
+    MAX_STRINGS = 4096
+
+    def __init__(self):
+        self.pools: list[tuple[int,int,int,int]] = []
+        self.starts: list[int] = []
+        self.static_count = 0
+        self.generation = -1
+        self.last_pool = None
+        self._static_strings: dict[int, str] = {}
+        self._dynamic_strings: collections.OrderedDict[int, str] = collections.OrderedDict()
+
+    def _read_pool(self, pool_ptr:int):
+        pool = mem.value(pool_ptr, pool_t)
+        entry = (int(pool["total_prev_len"]), int(pool["len"]), pool_ptr + pool_qstrs.bitpos // 8, pool_ptr)
+        return entry, int(pool["prev"])
+
+    def _is_static(self, pool_ptr:int) -> bool:
+        return not any(start <= pool_ptr < end for start, end, _ in heap._heap_area_bounds())
+
+    def refresh(self):
+        if self.generation == mem.cache.generation:
+            return
+        address, ptr_type = _last_pool_field()
+        last_pool = int(mem.value(address, ptr_type))
+        static = {entry[3]: i for i, entry in enumerate(self.pools[:self.static_count])}
+        new_pools = []
+        pool_ptr = last_pool
+        while pool_ptr and pool_ptr not in static:
+            entry, pool_ptr = self._read_pool(pool_ptr)
+            new_pools.append(entry)
+        keep = static[pool_ptr] + 1 if pool_ptr else 0
+        if keep < self.static_count:
+            self._static_strings.clear()
+            self.static_count = keep
+        self._dynamic_strings.clear()
+        pools = self.pools[:keep]
+        pools.extend(reversed(new_pools))
+        self.pools = pools
+        self.starts = [entry[0] for entry in pools]
+        while self.static_count < len(pools) and self._is_static(pools[self.static_count][3]):
+            self.static_count += 1
+        self.last_pool = last_pool
+        self.generation = mem.cache.generation
+
+    def find(self, qstr:int) -> tuple[int,int,int,int]|None:
+        self.refresh()
+        i = bisect.bisect_right(self.starts, qstr) - 1
+        if i < 0:
+            return None
+        entry = self.pools[i]
+        if qstr >= entry[0] + entry[1]:
+            return None
+        return entry
+
+    def pointer(self, qstr:int) -> gdb.Value|None:
+        entry = self.find(qstr)
+        if entry is None:
+            return None
+        char_ptr = pool_qstrs.type.target()
+        return mem.value(entry[2] + (qstr - entry[0]) * char_ptr.sizeof, char_ptr)
+
+    def string(self, qstr:int) -> str|None:
+        value = self._static_strings.get(qstr)
+        if value is not None:
+            return value
+        self.refresh()
+        value = self._dynamic_strings.get(qstr)
+        if value is not None:
+            self._dynamic_strings.move_to_end(qstr)
+            return value
+        ptr = self.pointer(qstr)
+        if ptr is None:
+            return None
+        value = mem.string(ptr)
+        if self.static_count and qstr < self.starts[self.static_count - 1] + self.pools[self.static_count - 1][1]:
+            self._static_strings[qstr] = value
+        else:
+            self._dynamic_strings[qstr] = value
+            while len(self._dynamic_strings) > self.MAX_STRINGS:
+                self._dynamic_strings.popitem(last=False)
+        return value
+
+@functools.cache
+def _last_pool_field() -> tuple[int, gdb.Type]:
+    field = file.micropython.lookup_global_symbol("mp_state_ctx", domain=gdb.SYMBOL_VAR_DOMAIN).value()["vm"]["last_pool"]
+    return int(field.address), field.type
+
+pools = PoolIndex()
+
+class QstrInfo(NamedTuple):
+    id: int
+    value: str
+    hash: int|None
+    length: int
+    pool: int
+    dynamic: bool
+
+class PoolInfo(NamedTuple):
+    address: int
+    first: int
+    count: int
+    alloc: int
+    dynamic: bool
+    size: int
+
+def _read_array(address:int, count:int, elem_size:int) -> list[int]:
+    data = mem.read(address, count * elem_size)
+    return [int.from_bytes(data[i:i + elem_size], "little") for i in range(0, len(data), elem_size)]
+
+def read_table() -> tuple[list[QstrInfo], list[PoolInfo]]:
+    """Every interned qstr, read pool by pool with one read per array.
+
+    Hashes and lengths come from the pool's own arrays when the port keeps
+    them, so strings can be read with their known length. A pool's size
+    counts its header, arrays and strings, as allocated for dynamic pools.
+    """
+    pools.refresh()
+    struct = pool_t.strip_typedefs()
+    fields = {field.name: field for field in struct.fields()}
+    ptr_size = pool_qstrs.type.target().sizeof
+    hash_size = fields["hashes"].type.target().sizeof if "hashes" in fields else 0
+    len_size = fields["lengths"].type.target().sizeof if "lengths" in fields else 0
+
+    qstrs = []
+    pool_infos = []
+    for num, (first, count, qstrs_addr, pool_addr) in enumerate(pools.pools):
+        pool = mem.value(pool_addr, pool_t)
+        alloc = int(pool["alloc"]) if "alloc" in fields else count
+        dynamic = num >= pools.static_count
+        pointers = _read_array(qstrs_addr, count, ptr_size)
+        hashes = _read_array(int(pool["hashes"]), count, hash_size) if hash_size else [None] * count
+        lengths = _read_array(int(pool["lengths"]), count, len_size) if len_size else None
+        size = struct.sizeof + alloc * (ptr_size + hash_size + len_size)
+        for i, ptr in enumerate(pointers):
+            if lengths is not None:
+                value = mem.read(ptr, lengths[i]).decode("utf-8", "replace")
+            else:
+                value = mem.string(ptr)
+            length = len(value.encode())
+            qstrs.append(QstrInfo(first + i, value, hashes[i], length, num, dynamic))
+            size += length + 1
+        pool_infos.append(PoolInfo(pool_addr, first, count, alloc, dynamic, size))
+    return qstrs, pool_infos
+
 def lookup(qstr: int) -> gdb.Value|None:
-    pool = file.micropython.lookup_global_symbol("mp_state_ctx", domain=gdb.SYMBOL_VAR_DOMAIN).value()["vm"]["last_pool"]
+    return pools.pointer(int(qstr))
 
-    qstr_max = int(pool["total_prev_len"]) + int(pool["len"])
-    if(qstr >= qstr_max):
-        return None
-    
-    while(qstr < int(pool["total_prev_len"])):
-        pool = pool["prev"]
-    
-    return pool["qstrs"][qstr - int(pool["total_prev_len"])]
+def string(qstr: int) -> str|None:
+    return pools.string(int(qstr))
 
 def get(qstr: int|gdb.Value) -> gdb.Value|None:
     qstr = decode_qstr(qstr)
@@ -41,7 +201,7 @@ class QstrPrinter(gdb.ValuePrinter):
     
     def to_string(self):
         try:
-            return lookup(self.__value).string()
+            return string(self.__value)
         except Exception as e:
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
@@ -66,5 +226,9 @@ class QstrPrinter(gdb.ValuePrinter):
             log.exception("%r", e, exc_info=True, stack_info=True)
             raise e
         
-file.micropython.pretty_printers.append(QstrPrinter.lookup)
+printers.register(qstr_t, QstrPrinter.lookup)
+printers.register(qstr_short_t, QstrPrinter.lookup)
+# An mp_obj_t holding a qstr is claimed before the generic object printers.
+for t in obj_types:
+    printers.register(t, QstrPrinter.lookup, first=True)
 log.info("Registered pretty printer: %s", QstrPrinter.__name__)
\ No newline at end of file
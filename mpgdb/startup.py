@@ -0,0 +1,41 @@
+import logging
+log = logging.getLogger("mpgdb.startup")
+import contextlib, importlib, importlib.util, sys, time
+from types import ModuleType
+
+# (what, seconds, deferred) in the order they finished.
+timings: list[tuple[str, float, bool]] = []
+
+def record(name:str, seconds:float, deferred:bool=False):
+    timings.append((name, seconds, deferred))
+    log.debug("%s took %.1f ms", name, seconds * 1000)
+
+@contextlib.contextmanager
+def timed(name:str, deferred:bool=False):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, deferred)
+
+def load(name:str) -> ModuleType:
+    """Import `name` on first use, recording how long it took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with timed(name, deferred=True):
+        return importlib.import_module(name)
+
+def lazy_module(name:str) -> ModuleType|None:
+    """`name`, imported on its first attribute access, or None if it is not installed."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
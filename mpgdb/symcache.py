@@ -0,0 +1,88 @@
+import logging
+log = logging.getLogger("mpgdb.symcache")
+import os, json, hashlib, tempfile
+import gdb
+from . import startup
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "mpgdb")
+
+_MISSING = object()
+
+def objfile_key(objfile:gdb.Objfile) -> str:
+    """The objfile's build-id, or a hash of its contents if it has none."""
+    if objfile.build_id:
+        return objfile.build_id
+    digest = hashlib.sha256()
+    with open(objfile.filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return "sha256-" + digest.hexdigest()
+
+class SymbolCache:
+    """Symbol and macro resolutions for one firmware build, kept on disk.
+
+    Entries are grouped into sections (one per lookup table) and map a name
+    to a JSON value, or to None for names known not to resolve. The file is
+    keyed by build-id, so a rebuilt firmware starts with an empty cache.
+    """
+    path: str|None
+    _sections: dict[str, dict[str, object]]|None
+    _dirty: bool
+
+    def __init__(self, objfile:gdb.Objfile):
+        # Identifying the objfile may hash the whole file, so wait until the
+        # first lookup needs the cache.
+        self._objfile = objfile
+        self._sections = None
+        self._dirty = False
+        self.path = None
+
+    def _load(self) -> dict[str, dict[str, object]]:
+        if self._sections is not None:
+            return self._sections
+        self._sections = {}
+        with startup.timed("symbol cache", deferred=True):
+            try:
+                key = objfile_key(self._objfile)
+            except OSError as e:
+                log.warning("Cannot identify %s (%s), symbol cache disabled", self._objfile.filename, e)
+                return self._sections
+            self.path = os.path.join(CACHE_DIR, f"{key}.v{CACHE_VERSION}.json")
+            try:
+                with open(self.path) as f:
+                    self._sections = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                log.warning("Ignoring unreadable symbol cache %s: %s", self.path, e)
+            else:
+                log.info("Loaded %d cached symbols from %s", sum(map(len, self._sections.values())), self.path)
+        return self._sections
+
+    def get(self, section:str, name:str, default=_MISSING):
+        return self._load().get(section, {}).get(name, default)
+
+    def put(self, section:str, name:str, value):
+        entries = self._load().setdefault(section, {})
+        if entries.get(name, _MISSING) != value:
+            entries[name] = value
+            self._dirty = True
+
+    def clear(self):
+        self._load()
+        self._sections = {}
+        self._dirty = True
+
+    def save(self, event=None):
+        if not self._dirty or self.path is None:
+            return
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=CACHE_DIR, delete=False) as f:
+                json.dump(self._sections, f)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            log.warning("Cannot write symbol cache %s: %s", self.path, e)
+        else:
+            self._dirty = False